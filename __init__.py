@@ -3,15 +3,18 @@ from .nodes.model_downloader import (
     DownloadLora,
     DownloadVAE,
     DownloadUNET,
-    DownloadControlNet
+    DownloadControlNet,
+    DownloadModelSet
 )
+from .nodes import prefetch, routes
 
 NODE_CLASS_MAPPINGS = {
     "DownloadCheckpoint": DownloadCheckpoint,
     "DownloadLora": DownloadLora,
     "DownloadVAE": DownloadVAE,
     "DownloadUNET": DownloadUNET,
-    "DownloadControlNet": DownloadControlNet
+    "DownloadControlNet": DownloadControlNet,
+    "DownloadModelSet": DownloadModelSet
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
@@ -19,7 +22,8 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     "DownloadLora": "(Down)load LoRA",
     "DownloadVAE": "(Down)load VAE",
     "DownloadUNET": "(Down)load UNET",
-    "DownloadControlNet": "(Down)load ControlNet"
+    "DownloadControlNet": "(Down)load ControlNet",
+    "DownloadModelSet": "(Down)load Model Set"
 }
 
 WEB_DIRECTORY = "./web"
@@ -0,0 +1,379 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+BLOCK_SIZE = 1024 * 1024
+HEADER_SIZE = 128
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+# 按文件名生成的确定性内容：数据部分由 1MB 的伪随机块重复组成，不占用磁盘也不需要在内存中保存整个文件。
+# .safetensors 文件带有合法的头部，声明一个覆盖全部数据的张量
+class FakeFile:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.block = random.Random(name).randbytes(min(BLOCK_SIZE, size))
+        self.prefix = b''
+        if name.endswith('.safetensors') and size > 8 + HEADER_SIZE:
+            length = size - 8 - HEADER_SIZE
+            header = json.dumps({"weight": {"dtype": "U8", "shape": [length], "data_offsets": [0, length]}})
+            self.prefix = struct.pack('<Q', HEADER_SIZE) + header.encode('utf-8').ljust(HEADER_SIZE, b' ')
+        self.sha256 = self.compute_sha256()
+        self.etag = f'"{self.sha256[:16]}"'
+
+    def chunks(self, start, end, chunk_size=64 * 1024):
+        # 依次返回 [start, end] 范围内的数据
+        position = start
+        while position <= end:
+            if position < len(self.prefix):
+                chunk = self.prefix[position:min(len(self.prefix), end + 1, position + chunk_size)]
+            else:
+                offset = (position - len(self.prefix)) % len(self.block)
+                chunk = self.block[offset:offset + min(chunk_size, end + 1 - position)]
+            position += len(chunk)
+            yield chunk
+
+    def compute_sha256(self):
+        hasher = hashlib.sha256()
+        for chunk in self.chunks(0, self.size - 1, BLOCK_SIZE):
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+
+# 按模型目录生成 Civitai 和 Hugging Face 的接口数据，以及文件服务器上的文件
+class FakeHub:
+    def __init__(self, catalog):
+        self.token = catalog.get('token')
+        self.files = {}
+        self.civitai_models = {}
+        self.civitai_versions = {}
+        self.hf_repos = {}
+        for model in catalog.get('civitai', []):
+            self.civitai_models[str(model['id'])] = model
+            for version in model['versions']:
+                self.civitai_versions[str(version['id'])] = (model, version)
+                for file in version['files']:
+                    self.add_file(f"civitai/{version['id']}/{file['name']}", file)
+                for image in version.get('images', []):
+                    self.add_file(f"images/{image['name']}", image)
+        for repo in catalog.get('huggingface', []):
+            self.hf_repos[repo['repo']] = repo
+            for file in repo['files']:
+                self.add_file(f"hf/{repo['repo']}/{file['path']}", file)
+
+    def add_file(self, key, spec):
+        self.files[key] = FakeFile(spec.get('name') or spec['path'], spec['size'])
+
+    def civitai_version(self, base_url, model, version):
+        files = []
+        for file in version['files']:
+            fake = self.files[f"civitai/{version['id']}/{file['name']}"]
+            files.append({
+                "name": file['name'],
+                "type": "Model",
+                "sizeKB": fake.size / 1024,
+                "hashes": {"SHA256": fake.sha256.upper()},
+                "downloadUrl": f"{base_url}/api/download/models/{version['id']}",
+            })
+        return {
+            "id": version['id'],
+            "modelId": model['id'],
+            "name": version.get('name', f"v{version['id']}"),
+            "baseModel": version.get('baseModel', "SDXL 1.0"),
+            "trainedWords": [],
+            "files": files,
+            "images": [{"url": f"{base_url}/cdn/images/{image['name']}"} for image in version.get('images', [])],
+        }
+
+    def civitai_model(self, base_url, model):
+        return {
+            "id": model['id'],
+            "name": model['name'],
+            "type": model.get('type', "LORA"),
+            "modelVersions": [self.civitai_version(base_url, model, version) for version in model['versions']],
+        }
+
+    def hf_tree(self, repo):
+        items = []
+        for file in repo['files']:
+            fake = self.files[f"hf/{repo['repo']}/{file['path']}"]
+            item = {"type": "file", "path": file['path'], "size": fake.size,
+                    "oid": hashlib.sha1(fake.etag.encode('utf-8')).hexdigest()}
+            if file.get('lfs', True):
+                item['lfs'] = {"oid": fake.sha256, "size": fake.size, "pointerSize": 134}
+            items.append(item)
+        return items
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def hub(self):
+        return self.server.hub
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def setup(self):
+        super().setup()
+        # 响应头和响应体分开写入，关闭 Nagle 算法避免与客户端的延迟确认叠加出 40ms 的额外延迟
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        # 客户端取消或中断传输时不输出异常
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_HEAD(self):
+        self.route(head=True)
+
+    def do_GET(self):
+        self.route()
+
+    def do_POST(self):
+        # /_control 修改限速和故障注入设置，/_reset 清零请求统计
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        path = urlparse(self.path).path
+        with self.server.lock:
+            if path == '/_control':
+                self.state.update(body)
+            elif path == '/_reset':
+                self.server.stats = new_stats()
+            else:
+                return self.send_empty(404)
+        self.send_json(dict(self.state))
+
+    def route(self, head=False):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+        base_url = f"http://{self.headers.get('Host')}"
+        self.count('requests')
+        if path == '/_stats':
+            with self.server.lock:
+                return self.send_json(dict(self.server.stats))
+        if path.startswith('/cdn/'):
+            return self.send_file(path[len('/cdn/'):], head)
+
+        # 其余都是接口请求，按设置模拟网络往返延迟
+        self.count('api_requests')
+        if self.state['api_latency']:
+            time.sleep(self.state['api_latency'])
+
+        match = re.match(r'^/api/v1/models/([^/]+)$', path)
+        if match:
+            model = self.hub.civitai_models.get(match.group(1))
+            if model is None:
+                return self.send_json({"error": "No model with id"}, 404)
+            return self.send_json(self.hub.civitai_model(base_url, model), head=head)
+
+        match = re.match(r'^/api/v1/model-versions/([^/]+)$', path)
+        if match:
+            found = self.hub.civitai_versions.get(match.group(1))
+            if found is None:
+                return self.send_json({"error": "Model version not found"}, 404)
+            model, version = found
+            data = dict(self.hub.civitai_version(base_url, model, version), model={"name": model['name']})
+            return self.send_json(data, head=head)
+
+        match = re.match(r'^/api/download/models/([^/]+)$', path)
+        if match:
+            found = self.hub.civitai_versions.get(match.group(1))
+            if found is None:
+                return self.send_empty(404)
+            model, version = found
+            if model.get('gated') and not self.authorized():
+                return self.send_empty(401)
+            return self.redirect(f"/cdn/civitai/{version['id']}/{quote(version['files'][0]['name'])}")
+
+        match = re.match(r'^/api/models/(.+)/tree/main$', path)
+        if match:
+            repo = self.hub.hf_repos.get(match.group(1))
+            if repo is None:
+                return self.send_json({"error": "Repository not found"}, 404)
+            if repo.get('gated') and not self.authorized():
+                return self.send_json({"error": "Access to model is restricted"}, 401)
+            items = self.hub.hf_tree(repo)
+            # 与 Hugging Face 一样按 cursor 分页，下一页地址放在 Link 头中
+            page_size = self.state['page_size'] or len(items) or 1
+            cursor = int(query.get('cursor', ['0'])[0])
+            headers = {}
+            if cursor + page_size < len(items):
+                headers['Link'] = f'<{base_url}{path}?recursive=true&cursor={cursor + page_size}>; rel="next"'
+            return self.send_json(items[cursor:cursor + page_size], headers=headers, head=head)
+
+        match = re.match(r'^/([^/]+/[^/]+)/resolve/main/(.+)$', path)
+        if match:
+            repo = self.hub.hf_repos.get(match.group(1))
+            if repo is None or f"hf/{repo['repo']}/{match.group(2)}" not in self.hub.files:
+                return self.send_empty(404)
+            if repo.get('gated') and not self.authorized():
+                return self.send_empty(401)
+            return self.redirect(f"/cdn/hf/{repo['repo']}/{quote(match.group(2))}")
+
+        self.send_empty(404)
+
+    def authorized(self):
+        return self.headers.get('Authorization') == f"Bearer {self.hub.token}"
+
+    def count(self, name, value=1):
+        with self.server.lock:
+            self.server.stats[name] = self.server.stats.get(name, 0) + value
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def redirect(self, location):
+        self.send_empty(302, {'Location': location})
+
+    def send_json(self, data, status=200, headers=None, head=False):
+        body = json.dumps(data).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            return self.send_empty(304, {'ETag': etag})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_file(self, key, head=False):
+        fake = self.hub.files.get(key)
+        if fake is None:
+            return self.send_empty(404)
+        with self.server.lock:
+            self.server.file_requests += 1
+            sequence = self.server.file_requests
+            state = dict(self.state)
+        if state['error_every'] and sequence % state['error_every'] == 0:
+            self.count('injected_errors')
+            return self.send_empty(state['error_status'])
+
+        start, end, status = 0, fake.size - 1, 200
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and state['ranges'] and (not if_range or if_range in (fake.etag, LAST_MODIFIED)):
+            match = re.match(r'bytes=(\d+)-(\d*)$', range_header)
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), fake.size - 1) if match.group(2) else fake.size - 1
+                if start >= fake.size:
+                    return self.send_empty(416, {'Content-Range': f'bytes */{fake.size}'})
+                status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', fake.etag)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        if state['ranges']:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{fake.size}')
+        self.end_headers()
+        if head:
+            return
+
+        # 每第 fail_every 个文件请求在发送 fail_after 字节后断开连接，模拟传输中断
+        fail_after = state['fail_after'] if state['fail_every'] and sequence % state['fail_every'] == 0 else None
+        rate = state['throttle']
+        sent = 0
+        started = time.monotonic()
+        try:
+            for chunk in fake.chunks(start, end):
+                if fail_after is not None and sent + len(chunk) > fail_after:
+                    self.wfile.write(chunk[:max(fail_after - sent, 0)])
+                    self.wfile.flush()
+                    self.count('injected_failures')
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    # 每个连接单独限速
+                    delay = sent / rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            self.count('bytes_sent', sent)
+
+
+def new_stats():
+    return {"requests": 0, "api_requests": 0, "bytes_sent": 0}
+
+
+def create_server(catalog, host='127.0.0.1', port=0, throttle=0, api_latency=0):
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.hub = FakeHub(catalog)
+    server.lock = threading.Lock()
+    server.stats = new_stats()
+    server.file_requests = 0
+    server.state = {
+        "throttle": throttle,
+        "api_latency": api_latency,
+        "ranges": True,
+        "page_size": 0,
+        "fail_every": 0,
+        "fail_after": 0,
+        "error_every": 0,
+        "error_status": 503,
+    }
+    return server
+
+
+def main(argv=None):
+    # 单独运行（在插件目录下）：
+    #   python -m benchmarks.fake_server catalog.json --port 8765
+    parser = argparse.ArgumentParser(description="本地模拟 Civitai / Hugging Face 接口和文件服务器")
+    parser.add_argument("catalog", help="模型目录 JSON 文件")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--throttle-mb", type=float, default=0, help="每个连接的限速（MB/s），0 表示不限速")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="每个接口请求的额外延迟（毫秒）")
+    args = parser.parse_args(argv)
+
+    with open(args.catalog, 'r', encoding='utf-8') as f:
+        catalog = json.load(f)
+    server = create_server(catalog, args.host, args.port, args.throttle_mb * 1024 * 1024, args.api_latency_ms / 1000)
+    # 启动完成后输出端口号，供调用方读取
+    print(f"READY {server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHIMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shims')
+
+SMALL_MODEL_ID = 1001
+LARGE_MODEL_ID = 1002
+GATED_MODEL_ID = 1003
+MISSING_MODEL_ID = 9999
+MULTI_REPO = "bench/multi-file"
+GATED_REPO = "bench/gated"
+MISSING_REPO = "bench/missing"
+
+SCENARIOS = ("cold", "warm", "single", "multi", "resume", "resume_segmented", "errors")
+
+# 用于和基准结果比较的指标，以及数值越大还是越小越好
+METRICS = {
+    "cold_latency_ms": "lower",
+    "warm_latency_us": "lower",
+    "warm_p95_us": "lower",
+    "revalidate_latency_ms": "lower",
+    "throughput_mb_s": "higher",
+    "cpu_seconds_per_gb": "lower",
+    "peak_rss_mb": "lower",
+    "checks_failed": "lower",
+}
+
+
+def build_catalog(args):
+    megabyte = 1024 * 1024
+    size = int(args.size_mb * megabyte)
+    part_size = max(size // args.files, 1024)
+    return {
+        "token": "bench-token",
+        "civitai": [
+            {"id": SMALL_MODEL_ID, "name": "Bench Small", "versions": [
+                {"id": 2001, "name": "v1", "files": [{"name": "bench_small.safetensors", "size": megabyte}]}]},
+            {"id": LARGE_MODEL_ID, "name": "Bench Large", "versions": [
+                {"id": 2002, "name": "v1", "files": [{"name": "bench_large.safetensors", "size": size}],
+                 "images": [{"name": "bench_large.png", "size": 256 * 1024}]}]},
+            {"id": GATED_MODEL_ID, "name": "Bench Gated", "gated": True, "versions": [
+                {"id": 2003, "name": "v1", "files": [{"name": "bench_gated.safetensors", "size": megabyte}]}]},
+        ],
+        "huggingface": [
+            {"repo": MULTI_REPO, "files": [{"path": f"model-{index:05d}-of-{args.files:05d}.safetensors", "size": part_size}
+                                           for index in range(1, args.files + 1)]},
+            {"repo": GATED_REPO, "gated": True, "files": [{"path": "model.safetensors", "size": megabyte}]},
+        ],
+    }
+
+
+def write_config(path, workdir, server_url, args):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"""[civitai]
+api_key =
+
+[huggingface]
+token =
+
+[manifest]
+path = {os.path.join(workdir, 'model_manifest.json')}
+
+[metadata]
+path = {os.path.join(workdir, 'metadata_cache')}
+
+[download]
+connections = {args.connections}
+max_workers = {args.max_workers}
+max_retries = 5
+
+[mirrors]
+civitai_api = {server_url}/api/v1
+huggingface_api = {server_url}
+huggingface_files = {server_url}
+""")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def server_request(server_url, path, data=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(f"{server_url}{path}", data=body, method='POST' if body else 'GET')
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+# 在单独的进程中运行一个场景，保证峰值内存等指标不受其他场景影响
+class Worker:
+    def __init__(self, args):
+        self.args = args
+        self.server_url = args.server
+        self.workdir = args.workdir
+        from lib.model_downloader import ModelDownloader
+        from lib.telemetry import telemetry
+        self.ModelDownloader = ModelDownloader
+        self.telemetry = telemetry
+
+    def reset(self):
+        # 清空模型目录、本地清单和元数据缓存，模拟首次下载
+        for name in ('models', 'metadata_cache', 'model_manifest.json'):
+            path = os.path.join(self.workdir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        return self.ModelDownloader()
+
+    def timed(self, fn):
+        started, cpu_started = time.perf_counter(), time.process_time()
+        result = fn()
+        return result, time.perf_counter() - started, time.process_time() - cpu_started
+
+    def last_download_event(self):
+        return next((event for event in reversed(self.telemetry.recent) if event['event'] == "download"), None)
+
+    def transfer_metrics(self, size, wall, cpu):
+        event = self.last_download_event() or {}
+        gigabytes = size / 1024 ** 3
+        return {
+            "bytes": size,
+            "seconds": wall,
+            "throughput_mb_s": size / 1024 / 1024 / wall,
+            "cpu_seconds": cpu,
+            "cpu_seconds_per_gb": cpu / gigabytes,
+            "phases": event.get('phases'),
+            "resume_retries": event.get('resume_retries'),
+            "http_retries": event.get('http_retries'),
+        }
+
+    def run_cold(self):
+        latencies = []
+        requests = []
+        for _ in range(self.args.repeat):
+            downloader = self.reset()
+            server_request(self.server_url, '/_reset', {})
+            _, wall, _ = self.timed(lambda: downloader.ensure_downloaded('lora', str(SMALL_MODEL_ID), 'civitai', 'SDXL'))
+            latencies.append(wall * 1000)
+            requests.append(server_request(self.server_url, '/_stats')['requests'])
+        return {
+            "cold_latency_ms": statistics.median(latencies),
+            "cold_min_ms": min(latencies),
+            "cold_max_ms": max(latencies),
+            "requests_per_resolve": statistics.median(requests),
+        }
+
+    def run_warm(self):
+        downloader = self.reset()
+        downloader.ensure_downloaded('lora', str(SMALL_MODEL_ID), 'civitai', 'SDXL')
+        latencies = []
+        for _ in range(self.args.warm_iterations):
+            _, wall, _ = self.timed(lambda: downloader.ensure_downloaded('lora', str(SMALL_MODEL_ID), 'civitai', 'SDXL'))
+            latencies.append(wall * 1000000)
+
+        # 本地清单过期后重新验证：元数据通过条件请求确认未变化，文件已存在不再下载
+        downloader.manifest_ttl = 1e-9
+        downloader.metadata_cache.ttl = 0
+        revalidations = []
+        for _ in range(self.args.repeat):
+            _, wall, _ = self.timed(lambda: downloader.ensure_downloaded('lora', str(SMALL_MODEL_ID), 'civitai', 'SDXL'))
+            revalidations.append(wall * 1000)
+        return {
+            "warm_latency_us": statistics.median(latencies),
+            "warm_p95_us": percentile(latencies, 0.95),
+            "revalidate_latency_ms": statistics.median(revalidations),
+        }
+
+    def run_single(self):
+        downloader = self.reset()
+        (path, _), wall, cpu = self.timed(
+            lambda: downloader.ensure_downloaded('checkpoint', str(LARGE_MODEL_ID), 'civitai', 'SDXL'))
+        size = os.path.getsize(os.path.join(downloader.model_types['checkpoint'], path))
+        return self.transfer_metrics(size, wall, cpu)
+
+    def run_multi(self):
+        downloader = self.reset()
+        _, wall, cpu = self.timed(lambda: downloader.ensure_downloaded('lora', MULTI_REPO, 'huggingface', 'SDXL'))
+        local_dir = os.path.join(downloader.model_types['lora'], 'SDXL')
+        size = sum(os.path.getsize(os.path.join(local_dir, name)) for name in os.listdir(local_dir))
+        return dict(self.transfer_metrics(size, wall, cpu), files=self.args.files)
+
+    def run_resume(self):
+        # 每个文件请求在发送约三分之一的数据后断开，下载需要多次续传才能完成
+        downloader = self.reset()
+        # 单连接续传；多连接分段续传见 resume_segmented
+        downloader.download_connections = 1
+        fail_after = int(self.args.size_mb * 1024 * 1024 / 3) + 1
+        server_request(self.server_url, '/_control', {"fail_every": 1, "fail_after": fail_after})
+        try:
+            (path, _), wall, cpu = self.timed(
+                lambda: downloader.ensure_downloaded('checkpoint', str(LARGE_MODEL_ID), 'civitai', 'SDXL'))
+        finally:
+            server_request(self.server_url, '/_control', {"fail_every": 0})
+        size = os.path.getsize(os.path.join(downloader.model_types['checkpoint'], path))
+        return self.transfer_metrics(size, wall, cpu)
+
+    def run_resume_segmented(self):
+        # 多连接分段下载，每第三个请求在传输半个分段后断开：其余分段继续下载，
+        # 中断的分段从已写入的位置续传
+        downloader = self.reset()
+        size = int(self.args.size_mb * 1024 * 1024)
+        downloader.download_connections = max(self.args.connections, 4)
+        downloader.segment_size = max(size // 13, 64 * 1024)
+        downloader.min_segmented_size = 0
+        server_request(self.server_url, '/_control', {"fail_every": 3, "fail_after": downloader.segment_size // 2})
+        try:
+            (path, _), wall, cpu = self.timed(
+                lambda: downloader.ensure_downloaded('checkpoint', str(LARGE_MODEL_ID), 'civitai', 'SDXL'))
+        finally:
+            server_request(self.server_url, '/_control', {"fail_every": 0})
+        size = os.path.getsize(os.path.join(downloader.model_types['checkpoint'], path))
+        return self.transfer_metrics(size, wall, cpu)
+
+    def run_errors(self):
+        # 需要登录和不存在的模型应该很快失败，并给出对应的错误信息
+        downloader = self.reset()
+        cases = {
+            "civitai_401": (('lora', str(GATED_MODEL_ID), 'civitai', 'SDXL'), "401"),
+            "civitai_404": (('lora', str(MISSING_MODEL_ID), 'civitai', 'SDXL'), "404"),
+            "huggingface_401": (('lora', GATED_REPO, 'huggingface', 'SDXL'), "401"),
+            "huggingface_404": (('lora', MISSING_REPO, 'huggingface', 'SDXL'), "404"),
+        }
+        checks = {}
+        for name, (call_args, expected) in cases.items():
+            started = time.perf_counter()
+            try:
+                downloader.ensure_downloaded(*call_args)
+                error = None
+            except Exception as e:
+                error = str(e)
+            checks[name] = {
+                "passed": error is not None and expected in error,
+                "latency_ms": (time.perf_counter() - started) * 1000,
+                "error": error and error.splitlines()[0],
+            }
+        return {"checks": checks, "checks_failed": sum(not check['passed'] for check in checks.values())}
+
+    def run(self, scenario):
+        rss_start = peak_rss_mb()
+        result = getattr(self, f"run_{scenario}")()
+        result['rss_start_mb'] = rss_start
+        result['peak_rss_mb'] = peak_rss_mb()
+        return result
+
+
+def start_server(catalog_path, args):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_server", catalog_path,
+         "--throttle-mb", str(args.throttle_mb), "--api-latency-ms", str(args.api_latency_ms)],
+        cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("READY "):
+        process.kill()
+        raise RuntimeError(f"模拟服务器启动失败: {line}")
+    return process, f"http://127.0.0.1:{int(line.split()[1])}"
+
+
+def run_scenario(scenario, server_url, workdir, args):
+    scenario_dir = os.path.join(workdir, scenario)
+    os.makedirs(scenario_dir, exist_ok=True)
+    config_path = os.path.join(scenario_dir, 'config.ini')
+    write_config(config_path, scenario_dir, server_url, args)
+    env = dict(
+        os.environ,
+        MODEL_DOWNLOADER_CONFIG=config_path,
+        MODEL_DOWNLOADER_MODELS_DIR=os.path.join(scenario_dir, 'models'),
+        PYTHONPATH=os.pathsep.join(filter(None, [SHIMS_DIR, ROOT_DIR, os.environ.get('PYTHONPATH')])),
+    )
+    command = [sys.executable, "-m", "benchmarks.run", "--worker", scenario, "--server", server_url,
+               "--workdir", scenario_dir] + worker_args(args)
+    # 进度条保持开启，与在 ComfyUI 中运行时的开销一致，只是不显示
+    completed = subprocess.run(command, cwd=ROOT_DIR, env=env, stdout=subprocess.PIPE,
+                               stderr=None if args.verbose else subprocess.PIPE, text=True)
+    if completed.returncode != 0:
+        error = (completed.stderr or "").strip().splitlines()
+        return {"error": f"退出码 {completed.returncode}" + (f": {error[-1]}" if error else "")}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def worker_args(args):
+    return ["--size-mb", str(args.size_mb), "--files", str(args.files), "--repeat", str(args.repeat),
+            "--warm-iterations", str(args.warm_iterations), "--connections", str(args.connections),
+            "--max-workers", str(args.max_workers)] + (["--verbose"] if args.verbose else [])
+
+
+def compare(results, baseline, tolerance):
+    # 与基准结果比较，变差超过容差的指标视为性能回退
+    regressions = []
+    for scenario, result in results.items():
+        base = baseline.get('results', {}).get(scenario, {})
+        for metric, direction in METRICS.items():
+            current, previous = result.get(metric), base.get(metric)
+            if current is None or previous is None:
+                continue
+            if metric == "checks_failed":
+                worse = current > previous
+            elif direction == "lower":
+                worse = current > previous * (1 + tolerance)
+            else:
+                worse = current < previous * (1 - tolerance)
+            if worse:
+                regressions.append(f"{scenario}.{metric}: {previous:.4g} -> {current:.4g}")
+    return regressions
+
+
+def format_results(results):
+    lines = []
+    for scenario, result in results.items():
+        if 'error' in result:
+            lines.append(f"{scenario}: 失败（{result['error']}）")
+            continue
+        values = [f"{metric}={result[metric]:.4g}" for metric in METRICS if result.get(metric) is not None]
+        lines.append(f"{scenario}: " + "  ".join(values))
+        for name, check in result.get('checks', {}).items():
+            lines.append(f"  {name}: {'通过' if check['passed'] else '失败'} ({check['latency_ms']:.1f} ms) {check['error'] or ''}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    # 在插件目录下运行：
+    #   python -m benchmarks.run --size-mb 512 --output results.json
+    #   python -m benchmarks.run --baseline results.json
+    parser = argparse.ArgumentParser(description="模型下载器性能测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"要运行的场景，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument("--size-mb", type=float, default=256, help="单文件和多文件场景的下载总大小（MB）")
+    parser.add_argument("--files", type=int, default=8, help="多文件场景的文件数量")
+    parser.add_argument("--connections", type=int, default=1, help="每个文件的下载连接数")
+    parser.add_argument("--max-workers", type=int, default=4, help="同时下载的文件数量")
+    parser.add_argument("--throttle-mb", type=float, default=0, help="模拟服务器每个连接的限速（MB/s）")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="模拟服务器每个接口请求的额外延迟（毫秒）")
+    parser.add_argument("--repeat", type=int, default=5, help="冷启动和重新验证的重复次数")
+    parser.add_argument("--warm-iterations", type=int, default=1000, help="命中本地清单的调用次数")
+    parser.add_argument("--output", help="把结果写入该 JSON 文件")
+    parser.add_argument("--baseline", help="与该 JSON 文件中的结果比较，出现回退时返回非零退出码")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的性能波动比例")
+    parser.add_argument("--workdir", help="工作目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--verbose", action="store_true", help="输出下载器的日志")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker = Worker(args)
+        # 下载器模块导入时会配置日志级别，需要在导入之后再调整
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        print(json.dumps(worker.run(args.worker)))
+        return 0
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(sorted(unknown))}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="model_downloader_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    catalog_path = os.path.join(workdir, 'catalog.json')
+    with open(catalog_path, 'w', encoding='utf-8') as f:
+        json.dump(build_catalog(args), f)
+
+    server, server_url = start_server(catalog_path, args)
+    results = {}
+    try:
+        for scenario in scenarios:
+            print(f"运行场景: {scenario}", file=sys.stderr, flush=True)
+            results[scenario] = run_scenario(scenario, server_url, workdir, args)
+    finally:
+        server.terminate()
+        server.wait()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(format_results(results))
+    output = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("worker", "server", "output", "baseline", "workdir", "verbose")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+
+    failed = any('error' in result or result.get('checks_failed') for result in results.values())
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("性能回退:\n" + "\n".join(f"  {line}" for line in regressions))
+            failed = True
+        else:
+            print("没有超过容差的性能回退")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,11 @@
+# 在 ComfyUI 之外运行时替代 ComfyUI 的 folder_paths 模块，只提供下载器用到的接口。
+# 模型目录由环境变量 MODEL_DOWNLOADER_MODELS_DIR 指定
+import os
+
+models_dir = os.path.abspath(os.environ.get('MODEL_DOWNLOADER_MODELS_DIR', 'models'))
+
+
+def get_folder_paths(folder_name):
+    path = os.path.join(models_dir, folder_name)
+    os.makedirs(path, exist_ok=True)
+    return [path]
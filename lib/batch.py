@@ -0,0 +1,181 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import DownloadCancelledError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+MODEL_TYPES = ("checkpoint", "lora", "vae", "unet", "controlnet")
+
+
+def parse_model_set(text):
+    # 模型清单支持 JSON 或 YAML，可以是列表，也可以是带 models 字段的对象
+    text = text.strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("模型清单不是有效的 JSON；如需使用 YAML 格式，请安装 PyYAML")
+        data = yaml.safe_load(text)
+    if isinstance(data, dict):
+        data = data.get('models', [])
+    if not isinstance(data, list):
+        raise ValueError("模型清单必须是列表，或包含 models 列表的对象")
+    entries = [normalize_entry(item, index) for index, item in enumerate(data)]
+    # 路径映射和统计都按 name 区分，重复的 name 会让结果互相覆盖
+    seen = {}
+    for index, entry in enumerate(entries):
+        if entry['name'] in seen:
+            raise ValueError(f"第 {index + 1} 项与第 {seen[entry['name']] + 1} 项的 name 重复: {entry['name']}")
+        seen[entry['name']] = index
+    return entries
+
+
+def normalize_entry(item, index):
+    if not isinstance(item, dict):
+        raise ValueError(f"第 {index + 1} 项不是对象: {item}")
+    model_type = item.get('type')
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f"第 {index + 1} 项的 type 无效: {model_type}，可选值: {', '.join(MODEL_TYPES)}")
+    source = item.get('source', 'civitai')
+    if source not in ("civitai", "huggingface"):
+        raise ValueError(f"第 {index + 1} 项的 source 无效: {source}")
+    if not item.get('model_id') or not item.get('base_model'):
+        raise ValueError(f"第 {index + 1} 项缺少 model_id 或 base_model")
+    files = item.get('files') or None
+    if isinstance(files, str):
+        files = files.splitlines()
+    version_id = item.get('version_id')
+    entry = {
+        "type": model_type,
+        "source": source,
+        "model_id": str(item['model_id']),
+        "version_id": str(version_id) if version_id else "",
+        "base_model": item['base_model'],
+        # 与单个下载节点一致：files 只对 huggingface 生效
+        "files": [f for f in files if f.strip()] if files and source == "huggingface" else None,
+    }
+    # 默认名称包含本地清单键的所有组成部分，基础模型或文件不同的同一个模型不会重名
+    entry["name"] = item.get('name') or f"{model_type}:{source}:{entry['model_id']}" + (
+        f"@{entry['version_id']}" if entry['version_id'] else "") + f":{entry['base_model']}" + (
+        f":{','.join(sorted(entry['files']))}" if entry['files'] else "")
+    return entry
+
+
+def get_download_args(entry):
+    return entry['type'], entry['model_id'], entry['source'], entry['base_model'], entry['version_id'], entry['files']
+
+
+def resolve_metadata(downloader, entries, max_workers):
+    # 先并发获取所有未命中清单的模型信息，写入元数据缓存，后续下载时不再重复请求
+    def resolve(entry):
+        try:
+            downloader.get_model_info(entry['source'], entry['model_id'], entry['version_id'])
+        except Exception as e:
+            logging.warning(f"获取模型信息失败: {entry['name']}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(resolve, entries))
+
+
+def download_model_set(downloader, entries, max_workers=4, priority=PRIORITY_INTERACTIVE, progress_listener=None):
+    started = time.time()
+    hits = {entry['name'] for entry in entries if downloader.lookup_cached(*get_download_args(entry))}
+    misses = [entry for entry in entries if entry['name'] not in hits]
+    if misses and not downloader.offline:
+        resolve_metadata(downloader, misses, max_workers)
+
+    paths = {}
+    errors = {}
+    cancelled = []
+
+    def download(entry):
+        try:
+            relative_path, _ = downloader.ensure_downloaded(*get_download_args(entry), priority=priority,
+                                                              progress_listener=progress_listener)
+            paths[entry['name']] = relative_path
+        except DownloadCancelledError as e:
+            cancelled.append(e)
+        except Exception as e:
+            logging.error(f"下载模型失败: {entry['name']}: {e}")
+            errors[entry['name']] = str(e)
+
+    # 只统计这组模型自己的下载任务传输的字节数，不包括同时进行的其他下载
+    keys = {downloader.get_manifest_key(*get_download_args(entry)) for entry in entries}
+    with downloader.telemetry.collect(keys) as events, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(download, entries))
+    if cancelled:
+        raise cancelled[0]
+
+    summary = {
+        "total": len(entries),
+        "hits": len(hits),
+        "downloaded": len([entry for entry in misses if entry['name'] in paths]),
+        "failed": len(errors),
+        "bytes_transferred": sum(event['bytes'] for event in events),
+        "seconds": round(time.time() - started, 2),
+        "errors": errors,
+    }
+    return paths, summary
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.2f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+
+def format_summary(summary):
+    text = (
+        f"模型总数: {summary['total']}\n"
+        f"命中本地清单: {summary['hits']}\n"
+        f"新下载: {summary['downloaded']}\n"
+        f"失败: {summary['failed']}\n"
+        f"传输数据: {format_size(summary['bytes_transferred'])}\n"
+        f"耗时: {summary['seconds']} 秒"
+    )
+    for name, error in summary['errors'].items():
+        text += f"\n{name}: {error}"
+    return text
+
+
+def main(argv=None):
+    # 命令行用法（在插件目录下运行）：
+    #   python -m lib.batch models.json --comfyui /path/to/ComfyUI
+    parser = argparse.ArgumentParser(description="按模型清单批量下载模型")
+    parser.add_argument("manifest", help="JSON 或 YAML 格式的模型清单文件")
+    parser.add_argument("--comfyui", default=os.environ.get("COMFYUI_PATH"), help="ComfyUI 根目录")
+    parser.add_argument("--max-workers", type=int, default=4, help="同时下载的模型数量")
+    parser.add_argument("--output", help="把路径映射和统计结果写入该 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if args.comfyui:
+        sys.path.insert(0, os.path.abspath(args.comfyui))
+    try:
+        from .model_downloader import get_model_downloader
+    except ImportError as e:
+        parser.error(f"无法导入 ComfyUI 模块（{e}），请通过 --comfyui 指定 ComfyUI 根目录")
+
+    with open(args.manifest, 'r', encoding='utf-8') as f:
+        entries = parse_model_set(f.read())
+    paths, summary = download_model_set(get_model_downloader(), entries, args.max_workers, PRIORITY_BACKGROUND)
+    print(format_summary(summary))
+    result = {"paths": paths, "summary": summary}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(paths, ensure_ascii=False, indent=2))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
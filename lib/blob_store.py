@@ -0,0 +1,61 @@
+import logging
+import os
+import shutil
+
+
+# 以 SHA256 为键的内容寻址存储：每个文件在磁盘上只保存一份，
+# 各模型目录中的文件名通过硬链接（跨文件系统时使用符号链接）指向同一份数据
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+
+    def blob_path(self, sha256):
+        sha256 = sha256.lower()
+        return os.path.join(self.root, "sha256", sha256[:2], sha256)
+
+    def has(self, sha256):
+        return os.path.isfile(self.blob_path(sha256))
+
+    def ingest(self, path, sha256):
+        blob = self.blob_path(sha256)
+        if os.path.exists(blob):
+            if not os.path.samefile(blob, path):
+                # 已有相同内容，释放重复的副本
+                self.link(sha256, path)
+            return blob
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(path, blob)
+        except OSError:
+            # 跨文件系统时无法硬链接，把文件移入存储后再链接回原位置
+            shutil.move(path, blob)
+            self.link(sha256, path)
+        return blob
+
+    def link(self, sha256, target):
+        blob = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        tmp_path = f"{target}.link.tmp"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(blob, tmp_path)
+        except OSError:
+            try:
+                os.symlink(blob, tmp_path)
+            except OSError:
+                logging.warning(f"无法创建链接，复制文件: {blob} -> {target}")
+                shutil.copy2(blob, tmp_path)
+        os.replace(tmp_path, target)
+        return target
+
+    def release(self, sha256):
+        # 没有任何模型目录中的文件再链接到该数据时，从存储中删除以释放空间
+        blob = self.blob_path(sha256)
+        try:
+            if os.stat(blob).st_nlink <= 1:
+                os.remove(blob)
+                return True
+        except OSError:
+            pass
+        return False
@@ -0,0 +1,305 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+MODEL_EXTENSIONS = ('.safetensors', '.sft', '.ckpt', '.pt', '.pth', '.bin', '.gguf', '.onnx')
+# Civitai 以 KB 为单位返回文件大小，比较时允许 1KB 以内的误差
+SIZE_TOLERANCE = 1024
+MAX_HEADER_SIZE = 100 * 1024 * 1024
+
+
+def check_safetensors(path, size):
+    # 只读取 safetensors 的 JSON 头部，检查声明的张量数据范围是否都在文件长度以内，
+    # 可以发现截断的文件和非 safetensors 内容（如下载到的 HTML 错误页面）
+    if size < 8:
+        return "文件太小，不是有效的 safetensors 文件"
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        if header_size > MAX_HEADER_SIZE or 8 + header_size > size:
+            return f"safetensors 头部长度无效: {header_size}"
+        try:
+            header = json.loads(f.read(header_size))
+        except ValueError as e:
+            return f"safetensors 头部不是有效的 JSON: {e}"
+    if not isinstance(header, dict):
+        return "safetensors 头部格式无效"
+    data_size = size - 8 - header_size
+    for name, tensor in header.items():
+        if name == '__metadata__':
+            continue
+        offsets = tensor.get('data_offsets') if isinstance(tensor, dict) else None
+        if not isinstance(offsets, list) or len(offsets) != 2 or \
+                not all(isinstance(offset, int) and not isinstance(offset, bool) for offset in offsets) or \
+                not 0 <= offsets[0] <= offsets[1]:
+            return f"张量 {name} 的数据范围无效: {offsets}"
+        if offsets[1] > data_size:
+            return f"文件不完整：张量 {name} 的数据范围 {offsets} 超出了文件长度（数据部分 {data_size} 字节）"
+    return None
+
+
+def check_file(path, size, expected_size=None):
+    # 返回文件不可用的原因，文件可用时返回 None
+    if size == 0:
+        # 远端记录的大小为 0 的文件（如 .gitkeep）本来就是空文件
+        return None if expected_size == 0 else "文件大小为 0"
+    if expected_size is not None and abs(size - expected_size) >= SIZE_TOLERANCE:
+        return f"文件大小 {size} 与远端记录的大小 {expected_size} 不一致"
+    if path.lower().endswith(('.safetensors', '.sft')):
+        return check_safetensors(path, size)
+    return None
+
+
+# 模型文件的快速校验：比较文件大小并检查 safetensors 头部，不计算哈希。
+# 结果按 (路径, 修改时间, 大小) 缓存在磁盘上，文件没有变化时不再重复读取
+class FileValidator:
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.results = None
+
+    def load(self):
+        if self.results is not None:
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.results = json.load(f)
+        except (OSError, ValueError):
+            self.results = {}
+
+    def save(self):
+        # 顺便清理已经不存在的文件
+        self.results = {path: result for path, result in self.results.items() if os.path.exists(path)}
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.results, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.warning(f"写入文件校验缓存失败: {self.cache_path}: {e}")
+
+    def lookup(self, path, stat, expected_size):
+        result = self.results.get(path)
+        if not result or result['size'] != stat.st_size or result['mtime'] != stat.st_mtime:
+            return None
+        # 完整校验发现的哈希不一致与期望的大小无关，文件没有变化就一直有效
+        if result.get('audit') or result.get('expected_size') == expected_size:
+            return result
+        return None
+
+    def validate(self, paths):
+        # paths 为 {路径: 期望的大小（未知时为 None）}，返回 {路径: 不可用的原因}
+        invalid = {}
+        changed = False
+        with self.lock:
+            self.load()
+            for path, expected_size in paths.items():
+                path = os.path.abspath(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    invalid[path] = "文件不存在"
+                    continue
+                result = self.lookup(path, stat, expected_size)
+                if result is None:
+                    try:
+                        reason = check_file(path, stat.st_size, expected_size)
+                    except OSError as e:
+                        reason = f"读取文件失败: {e}"
+                    result = {"size": stat.st_size, "mtime": stat.st_mtime, "expected_size": expected_size, "reason": reason}
+                    self.results[path] = result
+                    changed = True
+                    if reason:
+                        logging.warning(f"模型文件校验失败，将重新下载: {path}: {reason}")
+                if result['reason']:
+                    invalid[path] = result['reason']
+            if changed:
+                self.save()
+        return invalid
+
+    def is_valid(self, path, expected_size=None):
+        return not self.validate({path: expected_size})
+
+    def check_entry(self, entry):
+        sizes = entry.get('sizes') or {}
+        return not self.validate({path: sizes.get(path) for path in entry.get('local_paths') or []})
+
+    def mark_invalid(self, path, reason):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            self.load()
+            self.results[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "expected_size": None,
+                                  "reason": reason, "audit": True}
+            self.save()
+
+
+def forget_corrupted(manifest, blob_store, path):
+    # 损坏的文件不再作为其记录哈希的副本，避免重新下载时从内容存储或清单中链接回同样损坏的数据
+    record = manifest.get_recorded_hash(path)
+    if not record:
+        return
+    manifest.remove_hash(path)
+    if blob_store and blob_store.has(record['sha256']):
+        blob = blob_store.blob_path(record['sha256'])
+        if os.path.samefile(blob, path):
+            os.remove(blob)
+
+
+def find_model_files(model_dirs):
+    # 遍历各模型目录，跳过 .locks、.blobs 等隐藏目录和下载中的临时文件
+    paths = []
+    for model_dir in model_dirs:
+        for root, dirs, files in os.walk(model_dir):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(MODEL_EXTENSIONS))
+    return sorted(set(paths))
+
+
+def hash_file(path, buffer_size=8 * 1024 * 1024):
+    # hashlib 处理大块数据时会释放 GIL，多个文件可以在线程池中并行计算
+    hasher = hashlib.sha256()
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            hasher.update(view[:size])
+    return hasher.hexdigest()
+
+
+# 对整个模型目录计算 SHA256 并与下载时记录的哈希比较。耗时较长，只在显式请求时于后台运行：
+# 一致的文件标记为已校验，不一致的文件标记为不可用，下次使用时重新下载
+class IntegrityAudit:
+    def __init__(self, manifest, validator, blob_store=None, max_workers=4):
+        self.manifest = manifest
+        self.validator = validator
+        self.blob_store = blob_store
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.thread = None
+        self.state = {"running": False}
+
+    def start(self, model_dirs):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return False
+            self.thread = threading.Thread(target=self.run, args=(model_dirs,), name="model_audit", daemon=True)
+            self.state = {"running": True}
+            self.thread.start()
+        return True
+
+    def run(self, model_dirs):
+        paths = find_model_files(model_dirs)
+        # 通过硬链接共享数据的文件只计算一次
+        groups = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            groups.setdefault((stat.st_dev, stat.st_ino), (stat.st_size, []))[1].append(path)
+        with self.lock:
+            self.state = {
+                "running": True,
+                "started_at": time.time(),
+                "finished_at": None,
+                "files": len(paths),
+                "total_bytes": sum(size for size, _ in groups.values()),
+                "checked_bytes": 0,
+                "verified": 0,
+                "unknown": 0,
+                "mismatched": [],
+                "errors": [],
+            }
+        logging.info(f"开始校验 {len(paths)} 个模型文件的 SHA256")
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model_audit") as executor:
+                futures = {executor.submit(hash_file, group[0]): (size, group) for size, group in groups.values()}
+                for future in as_completed(futures):
+                    size, group = futures[future]
+                    try:
+                        self.record(group, future.result())
+                    except OSError as e:
+                        with self.lock:
+                            self.state['errors'].append({"path": group[0], "error": str(e)})
+                    with self.lock:
+                        self.state['checked_bytes'] += size
+        finally:
+            with self.lock:
+                self.state['running'] = False
+                self.state['finished_at'] = time.time()
+                state = dict(self.state)
+        logging.info(f"模型文件校验完成: {state['verified']} 个一致，{len(state['mismatched'])} 个不一致，"
+                     f"{state['unknown']} 个没有下载记录")
+        return state
+
+    def record(self, paths, sha256):
+        for path in paths:
+            record = self.manifest.get_recorded_hash(path)
+            if not record:
+                # 手动放入的文件没有下载记录，无从比较；也不记录哈希，以免被磁盘配额当作插件下载的文件清理
+                with self.lock:
+                    self.state['unknown'] += 1
+                continue
+            if record['sha256'] == sha256:
+                self.manifest.record_hash(path, sha256, verified=True)
+                with self.lock:
+                    self.state['verified'] += 1
+                continue
+            logging.error(f"模型文件 SHA256 不一致，下次使用时重新下载: {path}\n期望: {record['sha256']}\n实际: {sha256}")
+            if self.validator:
+                self.validator.mark_invalid(path, "SHA256 与下载时记录的不一致")
+            forget_corrupted(self.manifest, self.blob_store, path)
+            with self.lock:
+                self.state['mismatched'].append({"path": path, "expected": record['sha256'], "actual": sha256})
+
+    def stats(self):
+        with self.lock:
+            state = dict(self.state)
+        if state.get('total_bytes'):
+            state['progress'] = state['checked_bytes'] / state['total_bytes']
+        return state
+
+
+def main(argv=None):
+    # 命令行用法（在插件目录下运行）：
+    #   python -m lib.integrity --comfyui /path/to/ComfyUI --workers 8
+    parser = argparse.ArgumentParser(description="校验所有模型文件的 SHA256")
+    parser.add_argument("--comfyui", default=os.environ.get("COMFYUI_PATH"), help="ComfyUI 根目录")
+    parser.add_argument("--workers", type=int, help="同时校验的文件数量，默认使用配置文件中的 audit_workers")
+    parser.add_argument("--output", help="把校验结果写入该 JSON 文件")
+    args = parser.parse_args(argv)
+
+    if args.comfyui:
+        sys.path.insert(0, os.path.abspath(args.comfyui))
+    try:
+        from .model_downloader import get_model_downloader
+    except ImportError as e:
+        parser.error(f"无法导入 ComfyUI 模块（{e}），请通过 --comfyui 指定 ComfyUI 根目录")
+
+    downloader = get_model_downloader()
+    if args.workers:
+        downloader.audit.max_workers = args.workers
+    state = downloader.audit.run(list(downloader.model_types.values()))
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+    return 1 if state['mismatched'] or state['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from filelock import FileLock, Timeout
+
+
+# 同一进程内对同一个 key 的并发调用只执行一次，其余调用者等待并共享同一个结果
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self, key):
+        with self._lock:
+            return self._calls.get(key)
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            logging.info(f"相同模型正在下载，等待其完成: {key}")
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+single_flight = SingleFlight()
+
+_registry_lock = threading.Lock()
+_thread_locks = {}
+
+
+# 进程内锁 + 跨进程文件锁。文件锁放在共享的模型目录下，
+# 多台机器通过 NFS 共享模型目录时同样生效
+class DownloadLocks:
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+
+    def lock_path(self, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.lock_dir, f"{digest}.lock")
+
+    @contextmanager
+    def hold(self, name):
+        path = self.lock_path(name)
+        with _registry_lock:
+            thread_lock = _thread_locks.setdefault(path, threading.Lock())
+        with thread_lock:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            file_lock = FileLock(path)
+            try:
+                file_lock.acquire(timeout=0)
+            except Timeout:
+                logging.info(f"其他进程正在下载，等待其完成: {name}")
+                file_lock.acquire()
+            try:
+                yield
+            finally:
+                file_lock.release()
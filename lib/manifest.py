@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from filelock import FileLock
+
+
+# 本地模型清单：记录 (来源, 模型ID, 版本, 文件, 基础模型) 到本地路径和模型详情的映射，
+# 命中时无需任何网络请求即可返回结果
+class ModelManifest:
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        # 多个进程（或共享模型目录的多台机器）可能同时写入同一个清单
+        self._file_lock = FileLock(f"{path}.lock")
+        self._entries = {}
+        self._hashes = {}
+        self._mtime = None
+
+    @staticmethod
+    def make_key(model_type, source, model_id, base_model, version_id=None, file_names=None):
+        files = "\n".join(sorted(f.strip() for f in file_names if f.strip())) if file_names else ""
+        return json.dumps(
+            [model_type, source, str(model_id).strip(), str(version_id or "").strip(), files, base_model],
+            ensure_ascii=False,
+        )
+
+    def _reload_if_changed(self, force=False):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime and not force:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self._entries = data.get('entries', {})
+            self._hashes = data.get('hashes', {})
+            self._mtime = mtime
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取模型清单失败，将忽略该文件: {self.path}: {e}")
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self.VERSION, "entries": self._entries, "hashes": self._hashes}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.path.getmtime(self.path)
+
+    @contextmanager
+    def _update(self):
+        # 读取、修改、写回期间持有跨进程文件锁，并且总是重新读取文件：
+        # 修改时间的精度有限，不能据此判断其他进程是否刚刚写入过
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with self._file_lock:
+                self._reload_if_changed(force=True)
+                yield
+                try:
+                    self._save()
+                except OSError as e:
+                    logging.warning(f"写入模型清单失败: {self.path}: {e}")
+
+    @staticmethod
+    def _files_present(entry):
+        paths = entry.get('local_paths') or []
+        if not paths:
+            return False
+        sizes = entry.get('sizes') or {}
+        for path in paths:
+            try:
+                # 远端记录的大小为 0 的文件（如 .gitkeep）本来就是空文件
+                if os.path.getsize(path) == 0 and sizes.get(path) != 0:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def lookup(self, key):
+        # 只返回本地文件仍然完整存在的条目
+        with self._lock:
+            self._reload_if_changed()
+            entry = self._entries.get(key)
+        if entry and self._files_present(entry):
+            return entry
+        return None
+
+    def is_stale(self, entry, ttl):
+        if not ttl or ttl <= 0:
+            return False
+        return time.time() - entry.get('updated_at', 0) > ttl
+
+    def put(self, key, local_paths, relative_path, model_details, preview_path=None, sizes=None):
+        entry = {
+            "local_paths": [os.path.abspath(p) for p in local_paths],
+            # 远端记录的文件大小，用于快速校验本地文件是否完整
+            "sizes": {os.path.abspath(p): size for p, size in (sizes or {}).items() if size is not None},
+            "relative_path": relative_path,
+            "model_details": model_details,
+            "preview_path": preview_path,
+            "updated_at": time.time(),
+            "last_used": time.time(),
+        }
+        with self._update():
+            self._entries[key] = entry
+        return entry
+
+    def touch(self, key, min_interval=60):
+        # 记录最近一次使用时间，用于磁盘配额的 LRU 清理；间隔很短的重复使用不重复写入文件
+        now = time.time()
+        with self._lock:
+            self._reload_if_changed()
+            entry = self._entries.get(key)
+            if not entry or now - entry.get('last_used', 0) < min_interval:
+                return
+            with self._update():
+                entry = self._entries.get(key)
+                if entry:
+                    entry['last_used'] = now
+
+    def entries(self):
+        with self._lock:
+            self._reload_if_changed()
+            return list(self._entries.items())
+
+    def remove(self, key):
+        with self._update():
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # 仍被其他条目引用的文件保留其哈希记录
+                referenced = {path for other in self._entries.values() for path in other.get('local_paths') or []}
+                for path in entry.get('local_paths') or []:
+                    if path not in referenced:
+                        self._hashes.pop(path, None)
+        return entry
+
+    def is_downloaded(self, path):
+        # 只有由插件下载（或从内容存储链接）的文件才有哈希记录，手动放入的文件没有
+        with self._lock:
+            self._reload_if_changed()
+            return os.path.abspath(path) in self._hashes
+
+    def record_hash(self, path, sha256, verified=False):
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._update():
+            self._hashes[path] = {
+                "sha256": sha256,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "verified": verified,
+            }
+
+    def get_hash(self, path):
+        # 只有文件大小和修改时间都没有变化时，记录的哈希才可信
+        path = os.path.abspath(path)
+        with self._lock:
+            self._reload_if_changed()
+            record = self._hashes.get(path)
+        if not record:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != record.get('size') or stat.st_mtime != record.get('mtime'):
+            return None
+        return record
+
+    def get_recorded_hash(self, path):
+        # 不检查文件是否变化，供完整校验与实际内容比较
+        with self._lock:
+            self._reload_if_changed()
+            return self._hashes.get(os.path.abspath(path))
+
+    def remove_hash(self, path):
+        with self._update():
+            self._hashes.pop(os.path.abspath(path), None)
+
+    def find_by_hash(self, sha256):
+        with self._lock:
+            self._reload_if_changed()
+            candidates = [path for path, record in self._hashes.items() if record.get('sha256') == sha256]
+        for path in candidates:
+            if self.get_hash(path):
+                return path
+        return None
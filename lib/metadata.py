@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+
+# Civitai / Hugging Face API 响应缓存：内存和磁盘两级 LRU，
+# 过期后通过 ETag / Last-Modified 条件请求重新验证，远端不可用时退回使用过期数据
+class MetadataCache:
+    def __init__(self, cache_dir, ttl=600, max_entries=256, max_disk_entries=2048):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # 命中新鲜缓存、条件请求返回 304、请求远端和远端失败时使用旧数据的次数
+        self._counts = {"hit": 0, "revalidated": 0, "miss": 0, "stale": 0}
+
+    def _disk_path(self, url):
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json")
+
+    def _get_entry(self, url):
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry is not None:
+                self._memory.move_to_end(url)
+                return entry
+        path = self._disk_path(url)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self._remember(url, entry)
+        return entry
+
+    def _remember(self, url, entry):
+        with self._lock:
+            self._memory[url] = entry
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, url, entry):
+        self._remember(url, entry)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._disk_path(url)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError as e:
+            logging.warning(f"写入元数据缓存失败: {e}")
+
+    def _evict_disk(self):
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.json')]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda path: os.path.getmtime(path))
+        for path in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _count(self, result):
+        with self._lock:
+            self._counts[result] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def fetch(self, session, url, headers=None, timeout=None):
+        entry = self._get_entry(url)
+        if entry and time.time() - entry['fetched_at'] < self.ttl:
+            self._count("hit")
+            return entry
+
+        request_headers = dict(headers or {})
+        if entry:
+            if entry.get('etag'):
+                request_headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                request_headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = session.get(url, headers=request_headers, timeout=timeout)
+            if entry and response.status_code == 304:
+                entry = dict(entry, fetched_at=time.time())
+                self._store(url, entry)
+                self._count("revalidated")
+                return entry
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            is_http_error = isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code < 500
+            if entry and not is_http_error:
+                logging.warning(f"请求远端元数据失败，使用缓存中的旧数据: {url}: {e}")
+                self._count("stale")
+                return entry
+            raise
+
+        self._count("miss")
+        entry = {
+            "data": response.json(),
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "next": response.links.get('next', {}).get('url'),
+            "fetched_at": time.time(),
+        }
+        self._store(url, entry)
+        return entry
+
+    def get_json(self, session, url, headers=None, timeout=None):
+        return self.fetch(session, url, headers, timeout)['data']
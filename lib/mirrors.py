@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def is_failover_error(error):
+    # 连接失败、超时和服务端错误时换用下一个镜像；404、401 等说明请求本身有问题，直接抛出。
+    # 连接池对 502/503/504 的重试用完后抛出的是 RetryError，同样属于服务端错误
+    if isinstance(error, requests.exceptions.RetryError):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        response = error.response
+        return response is None or response.status_code >= 500 or response.status_code == 429
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                              requests.exceptions.ChunkedEncodingError))
+
+
+class Mirror:
+    def __init__(self, url, index):
+        self.url = url.rstrip('/')
+        self.index = index
+        self.failures = 0
+        self.unhealthy_until = 0
+        self.latency = None
+        self.throughput = None
+
+    def is_healthy(self):
+        return time.time() >= self.unhealthy_until
+
+
+# 同一类地址（如 Civitai API、Hugging Face 文件）按顺序配置的多个镜像。
+# 记录每个镜像的健康状态、延迟和吞吐量，优先使用最快的可用镜像，失败后暂时跳过
+class MirrorPool:
+    def __init__(self, name, urls, origin=None, cooldown=60, probe_interval=600):
+        self.name = name
+        self.mirrors = [Mirror(url, index) for index, url in enumerate(urls)]
+        # 远端 API 返回的官方地址以 origin 开头时，可以改写为镜像地址
+        self.origin = (origin or self.mirrors[0].url).rstrip('/')
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.probed_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def urls(self):
+        return [mirror.url for mirror in self.mirrors]
+
+    def ordered(self):
+        # 可用的镜像在前。尚未测得吞吐量、但延迟不高于当前最快镜像的镜像先尝试一次，
+        # 否则只用过的第一个镜像会一直排在最前；其次按吞吐量从高到低，其余按延迟，最后按配置顺序。
+        # 全部不可用时仍按恢复时间返回，避免完全无法下载
+        with self.lock:
+            measured = [mirror for mirror in self.mirrors if mirror.is_healthy() and mirror.throughput]
+            fastest = max(measured, key=lambda mirror: mirror.throughput) if measured else None
+            best_latency = fastest.latency if fastest and fastest.latency is not None else float('inf')
+
+            def rank(mirror):
+                latency = mirror.latency if mirror.latency is not None else float('inf')
+                if mirror.throughput:
+                    group = 1
+                else:
+                    group = 0 if mirror.latency is not None and latency <= best_latency else 2
+                return (
+                    not mirror.is_healthy(),
+                    0 if mirror.is_healthy() else mirror.unhealthy_until,
+                    group,
+                    -(mirror.throughput or 0),
+                    latency,
+                    mirror.index,
+                )
+            return sorted(self.mirrors, key=rank)
+
+    def select(self):
+        return self.ordered()[0]
+
+    def record_success(self, mirror, latency=None):
+        with self.lock:
+            mirror.failures = 0
+            mirror.unhealthy_until = 0
+            if latency is not None:
+                mirror.latency = latency if mirror.latency is None else mirror.latency * 0.7 + latency * 0.3
+
+    def record_throughput(self, mirror, size, seconds):
+        if seconds <= 0 or size <= 0:
+            return
+        with self.lock:
+            throughput = size / seconds
+            mirror.throughput = throughput if mirror.throughput is None else mirror.throughput * 0.7 + throughput * 0.3
+
+    def record_failure(self, mirror, error=None):
+        with self.lock:
+            mirror.failures += 1
+            # 连续失败次数越多，跳过的时间越长
+            mirror.unhealthy_until = time.time() + min(self.cooldown * 2 ** (mirror.failures - 1), 3600)
+        if len(self.mirrors) > 1:
+            logging.warning(f"镜像暂时不可用，切换到其他镜像: {mirror.url}: {error}")
+
+    def probe(self, session, timeout):
+        # 首次使用时并发测量各镜像的响应延迟，之后每隔 probe_interval 秒重新测量；只有一个镜像时无需测量
+        with self.lock:
+            now = time.monotonic()
+            if len(self.mirrors) < 2 or (self.probed_at is not None and now - self.probed_at < self.probe_interval):
+                return
+            self.probed_at = now
+
+        def measure(mirror):
+            started = time.monotonic()
+            try:
+                response = session.head(mirror.url, timeout=timeout, allow_redirects=False)
+                if response.status_code >= 500:
+                    raise requests.exceptions.HTTPError(f"{response.status_code}", response=response)
+                self.record_success(mirror, time.monotonic() - started)
+            except requests.exceptions.RequestException as e:
+                self.record_failure(mirror, e)
+
+        with ThreadPoolExecutor(max_workers=len(self.mirrors)) as executor:
+            list(executor.map(measure, self.mirrors))
+
+    def call(self, fn):
+        # 依次在各镜像上执行 fn(镜像地址)，遇到可切换的错误时换用下一个镜像
+        last_error = None
+        for mirror in self.ordered():
+            try:
+                result = fn(mirror.url)
+            except requests.exceptions.RequestException as e:
+                if not is_failover_error(e):
+                    raise
+                self.record_failure(mirror, e)
+                last_error = e
+                continue
+            self.record_success(mirror)
+            return result
+        raise last_error
+
+    def matches(self, url):
+        return url == self.origin or url.startswith(self.origin + '/')
+
+    def rewrite(self, url, mirror):
+        # 把官方地址改写为指定镜像上的地址
+        if mirror is None or not self.matches(url):
+            return url
+        return mirror.url + url[len(self.origin):]
+
+    def stats(self):
+        with self.lock:
+            return [{
+                "url": mirror.url,
+                "healthy": mirror.is_healthy(),
+                "failures": mirror.failures,
+                "latency": mirror.latency,
+                "throughput": mirror.throughput,
+            } for mirror in self.mirrors]
+
+
+# 根据下载进度回调估算某个镜像上的实际传输速度
+class ThroughputMeter:
+    def __init__(self, on_progress):
+        self.on_progress = on_progress
+        self.first = None
+        self.last = None
+
+    def update(self, downloaded, total):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = (now, downloaded)
+        self.last = (now, downloaded)
+        self.on_progress(downloaded, total)
+
+    def record(self, pool, mirror):
+        if self.first and self.last:
+            pool.record_throughput(mirror, self.last[1] - self.first[1], self.last[0] - self.first[0])
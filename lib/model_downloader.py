@@ -4,30 +4,164 @@ import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 from tqdm import tqdm
-from huggingface_hub import hf_hub_download, HfApi, hf_hub_url
+from huggingface_hub import hf_hub_download, hf_hub_url, constants as hf_constants
 import logging
 import re
 import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlparse
 from folder_paths import get_folder_paths
+from .manifest import ModelManifest
+from .blob_store import BlobStore
+from .locks import DownloadLocks, single_flight
+from .metadata import MetadataCache
+from .stream import StreamInterruptedError, ProgressThrottle, check_free_space, copy_stream, preallocate
+from .scheduler import scheduler, DownloadCancelledError, PRIORITY_INTERACTIVE
+from .progress import progress
+from .mirrors import MirrorPool, ThroughputMeter, is_failover_error
+from .quota import DiskQuota
+from .previews import PreviewFetcher
+from .telemetry import telemetry, get_retry_count
+from .integrity import FileValidator, IntegrityAudit, forget_corrupted
 
 # 设置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class CivitaiAPI:
+class IncompleteDownloadError(IOError):
+    pass
+
+# 在数据写入磁盘的同时增量计算 SHA256；续传时只补算尚未计算的部分
+class StreamingHasher:
     def __init__(self):
-        self.base_url = "https://civitai.com/api/v1"
+        self.reset()
 
-    def get_model(self, model_id):
-        response = requests.get(f"{self.base_url}/models/{model_id}")
+    def reset(self):
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+
+    def update(self, data):
+        self.sha256.update(data)
+        self.offset += len(data)
+
+    def catch_up(self, path, offset):
+        if offset < self.offset:
+            self.reset()
+        if offset == self.offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self.offset)
+            while self.offset < offset:
+                chunk = f.read(min(1024 * 1024, offset - self.offset))
+                if not chunk:
+                    break
+                self.update(chunk)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+# 把多个文件各自的下载进度合并为一个总体百分比
+class AggregateProgress:
+    def __init__(self, callback, sizes=None):
+        self.callback = callback
+        self.totals = dict(sizes or {})
+        self.downloaded = {}
+        self.lock = threading.Lock()
+
+    def update(self, key, downloaded, total):
+        with self.lock:
+            self.downloaded[key] = downloaded
+            if total:
+                self.totals[key] = total
+            overall_total = sum(self.totals.values())
+            overall_downloaded = sum(self.downloaded.values())
+        self.callback(overall_downloaded, overall_total)
+
+CIVITAI_API_URL = "https://civitai.com/api/v1"
+CIVITAI_FILES_URL = "https://civitai.com"
+
+class CivitaiAPI:
+    def __init__(self, session=None, timeout=None, metadata_cache=None, mirrors=None, failover_session=None, failover_timeout=None):
+        self.mirrors = mirrors or MirrorPool('civitai_api', [CIVITAI_API_URL])
+        self.base_url = self.mirrors.origin
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.metadata_cache = metadata_cache
+        self.failover_session = failover_session
+        self.failover_timeout = failover_timeout
+
+    def get_session(self):
+        # 配置了多个镜像时使用不自动重试的会话和较短的连接超时，失败后立即换用下一个镜像
+        if self.failover_session and len(self.mirrors.mirrors) > 1:
+            return self.failover_session, self.failover_timeout
+        return self.session, self.timeout
+
+    def get_json(self, url):
+        session, timeout = self.get_session()
+        if self.metadata_cache:
+            return self.metadata_cache.get_json(session, url, timeout=timeout)
+        response = session.get(url, timeout=timeout)
         response.raise_for_status()
         return response.json()
 
+    def get_api_json(self, path):
+        # 按镜像的健康状态和速度依次尝试，失败时自动切换到下一个镜像
+        self.mirrors.probe(*self.get_session())
+        return self.mirrors.call(lambda base_url: self.get_json(f"{base_url}{path}"))
+
+    def get_model(self, model_id):
+        return self.get_api_json(f"/models/{model_id}")
+
+    def get_model_version(self, version_id):
+        return self.get_api_json(f"/model-versions/{version_id}")
+
+class HuggingFaceAPI:
+    def __init__(self, session=None, timeout=None, metadata_cache=None, token=None, mirrors=None, failover_session=None, failover_timeout=None):
+        self.mirrors = mirrors or MirrorPool('huggingface_api', [hf_constants.ENDPOINT])
+        self.endpoint = self.mirrors.origin
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.metadata_cache = metadata_cache
+        self.token = token
+        self.failover_session = failover_session
+        self.failover_timeout = failover_timeout
+
+    def get_session(self):
+        # 配置了多个镜像时使用不自动重试的会话和较短的连接超时，失败后立即换用下一个镜像
+        if self.failover_session and len(self.mirrors.mirrors) > 1:
+            return self.failover_session, self.failover_timeout
+        return self.session, self.timeout
+
+    def fetch(self, url):
+        headers = {'Authorization': f'Bearer {self.token}'} if self.token else {}
+        session, timeout = self.get_session()
+        if self.metadata_cache:
+            return self.metadata_cache.fetch(session, url, headers, timeout)
+        response = session.get(url, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return {"data": response.json(), "next": response.links.get('next', {}).get('url')}
+
+    def list_repo_tree(self, repo_id):
+        self.mirrors.probe(*self.get_session())
+        return self.mirrors.call(lambda endpoint: self.list_repo_tree_from(endpoint, repo_id))
+
+    def list_repo_tree_from(self, endpoint, repo_id):
+        # 一次请求同时得到文件列表、文件大小和 LFS 文件的 SHA256，大仓库按 Link 头分页
+        url = f"{endpoint}/api/models/{repo_id}/tree/main?recursive=true"
+        files = []
+        while url:
+            entry = self.fetch(url)
+            files.extend(item for item in entry['data'] if item.get('type') == 'file')
+            url = entry.get('next')
+        return files
+
 class ModelDownloader:
     def __init__(self, progress_callback=None):
+        self.config_lock = threading.Lock()
         self.config = self.load_config()
-        self.civitai_api_key = self.config.get('civitai', 'api_key', fallback=None)
-        self.huggingface_token = self.config.get('huggingface', 'token', fallback=None)
-        self.civitai = CivitaiAPI()
         self.model_types = {
             "checkpoint": get_folder_paths("checkpoints")[0],
             "lora": get_folder_paths("loras")[0],
@@ -38,14 +172,230 @@ class ModelDownloader:
         self.base_model_types = ["SD1.5", "SDXL", "Flux.1"]
         self.name = "ComfyUI Model Manager"
         self.name_zh = "ComfyUI 模型下载器"
-        self.hf_api = HfApi()
-        self.session = self.create_session()
         self.progress_callback = progress_callback
+        self.locks = DownloadLocks(os.path.join(self.get_models_dir(), '.locks'))
+        self.session = None
+        self.failover_session = None
+        self.session_pool_size = None
+        self.manifest = None
+        self.mirrors = {}
+        # 进程内累计从网络传输的字节数
+        self.bytes_transferred = 0
+        self.transferred_lock = threading.Lock()
+        self.apply_config()
+
+    def apply_config(self):
+        self.civitai_api_key = self.config.get('civitai', 'api_key', fallback=None)
+        self.huggingface_token = self.config.get('huggingface', 'token', fallback=None)
+        manifest_path = self.get_manifest_path()
+        if self.manifest is None or self.manifest.path != manifest_path:
+            self.manifest = ModelManifest(manifest_path)
+        self.manifest_ttl = self.config.getfloat('manifest', 'refresh_ttl', fallback=0)
+        self.offline = self.config.getboolean('manifest', 'offline', fallback=False)
+        self.download_retries = self.config.getint('download', 'max_retries', fallback=5)
+        self.download_timeout = (
+            self.config.getfloat('download', 'connect_timeout', fallback=30),
+            self.config.getfloat('download', 'read_timeout', fallback=300),
+        )
+        # 有多个镜像时的连接超时：连不上的镜像应尽快放弃，换用下一个镜像
+        self.failover_timeout = (
+            self.config.getfloat('mirrors', 'connect_timeout', fallback=5),
+            self.download_timeout[1],
+        )
+        self.download_connections = self.config.getint('download', 'connections', fallback=1)
+        self.max_workers = self.config.getint('download', 'max_workers', fallback=4)
+        self.blob_store = self.create_blob_store()
+        self.quota = self.create_disk_quota()
+        self.segment_size = int(self.config.getfloat('download', 'segment_size_mb', fallback=32) * 1024 * 1024)
+        self.min_segmented_size = int(self.config.getfloat('download', 'min_segmented_size_mb', fallback=64) * 1024 * 1024)
+        self.buffer_size = int(self.config.getfloat('download', 'buffer_size_kb', fallback=1024) * 1024)
+        self.min_free_space = int(self.config.getfloat('download', 'min_free_space_mb', fallback=1024) * 1024 * 1024)
+        self.progress_interval = self.config.getfloat('download', 'progress_interval', fallback=0.5)
+        self.scheduler = scheduler
+        self.configure_scheduler()
+        self.progress = progress
+        self.progress.interval = self.progress_interval
+        self.telemetry = telemetry
+        event_log = self.config.get('telemetry', 'event_log', fallback='')
+        self.telemetry.configure(
+            event_log=(event_log if os.path.isabs(event_log) else os.path.join(self.get_root_dir(), event_log)) if event_log else None,
+            recent_events=self.config.getint('telemetry', 'recent_events', fallback=100),
+        )
+        # 连接池大小变化时才重建会话，否则保留已建立的长连接
+        pool_size = self.get_pool_size()
+        if self.session is None or pool_size != self.session_pool_size:
+            self.session = self.create_session()
+            self.failover_session = self.create_session(retry=False)
+            self.session_pool_size = pool_size
+        self.metadata_cache = self.create_metadata_cache()
+        self.mirrors = self.create_mirrors()
+        self.civitai = CivitaiAPI(self.session, self.download_timeout, self.metadata_cache, self.mirrors['civitai_api'],
+                                  self.failover_session, self.failover_timeout)
+        self.huggingface = HuggingFaceAPI(self.session, self.download_timeout, self.metadata_cache,
+                                          self.huggingface_token, self.mirrors['huggingface_api'],
+                                          self.failover_session, self.failover_timeout)
+        self.preview_enabled = self.config.getboolean('preview', 'enabled', fallback=True)
+        self.previews = PreviewFetcher(
+            self.session,
+            self.download_timeout,
+            # 放在元数据缓存的子目录中，不参与元数据缓存的数量清理
+            os.path.join(self.metadata_cache.cache_dir, 'previews', 'failures.json'),
+            max_size=self.config.getint('preview', 'max_size', fallback=512),
+            retry_after=self.config.getfloat('preview', 'retry_after', fallback=86400),
+            max_workers=self.config.getint('preview', 'max_workers', fallback=2),
+        )
+        self.validator = self.create_validator()
+        self.audit = self.create_audit()
+
+    def reload_config_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return
+        if mtime == self.config_mtime:
+            return
+        with self.config_lock:
+            if mtime == self.config_mtime:
+                return
+            logging.info(f"配置文件已修改，重新加载: {self.config_path}")
+            self.config = self.load_config()
+            self.apply_config()
+
+    def configure_scheduler(self):
+        megabyte = 1024 * 1024
+        host_rate_limits = {}
+        for item in self.config.get('scheduler', 'host_rate_limits', fallback='').split(','):
+            if '=' in item:
+                host, rate = item.split('=', 1)
+                host_rate_limits[host.strip()] = float(rate) * megabyte
+        self.scheduler.configure(
+            max_transfers=self.config.getint('scheduler', 'max_transfers', fallback=0),
+            rate_limit=self.config.getfloat('scheduler', 'rate_limit_mb', fallback=0) * megabyte,
+            host_rate_limit=self.config.getfloat('scheduler', 'host_rate_limit_mb', fallback=0) * megabyte,
+            host_rate_limits=host_rate_limits,
+            preempt=self.config.getboolean('scheduler', 'preempt', fallback=True),
+        )
+
+    def get_root_dir(self):
+        # 项目根目录路径（当前文件所在目录的上一级目录）
+        return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def get_models_dir(self):
+        return os.path.dirname(self.model_types['checkpoint'])
+
+    def create_blob_store(self):
+        if not self.config.getboolean('store', 'enabled', fallback=False):
+            return None
+        # 默认放在 models 目录下，与各模型目录位于同一文件系统以便使用硬链接
+        path = self.config.get('store', 'path', fallback='') or os.path.join(self.get_models_dir(), '.blobs')
+        return BlobStore(path)
+
+    def create_disk_quota(self):
+        gigabyte = 1024 ** 3
+        return DiskQuota(
+            self.manifest,
+            self.model_types,
+            max_size=int(self.config.getfloat('quota', 'max_size_gb', fallback=0) * gigabyte),
+            type_limits={model_type: int(self.config.getfloat('quota', f'{model_type}_gb', fallback=0) * gigabyte)
+                         for model_type in self.model_types},
+            pinned=[item.strip() for item in self.config.get('quota', 'pinned', fallback='').split(',') if item.strip()],
+            blob_store=self.blob_store,
+        )
+
+    def create_metadata_cache(self):
+        path = self.config.get('metadata', 'path', fallback='') or 'metadata_cache'
+        return MetadataCache(
+            path if os.path.isabs(path) else os.path.join(self.get_root_dir(), path),
+            ttl=self.config.getfloat('metadata', 'ttl', fallback=600),
+            max_entries=self.config.getint('metadata', 'max_entries', fallback=256),
+            max_disk_entries=self.config.getint('metadata', 'max_disk_entries', fallback=2048),
+        )
+
+    def create_validator(self):
+        if not self.config.getboolean('integrity', 'enabled', fallback=True):
+            return None
+        path = os.path.join(self.metadata_cache.cache_dir, 'integrity', 'validation.json')
+        if getattr(self, 'validator', None) and self.validator.cache_path == path:
+            return self.validator
+        return FileValidator(path)
+
+    def create_audit(self):
+        max_workers = self.config.getint('integrity', 'audit_workers', fallback=4)
+        audit = getattr(self, 'audit', None)
+        # 保留正在运行或已完成的校验状态
+        if audit and audit.manifest is self.manifest:
+            audit.validator = self.validator
+            audit.blob_store = self.blob_store
+            audit.max_workers = max_workers
+            return audit
+        return IntegrityAudit(self.manifest, self.validator, self.blob_store, max_workers)
+
+    def start_audit(self):
+        return self.audit.start(list(self.model_types.values()))
+
+    def is_complete(self, path, expected_size=None):
+        # 本地文件是否可以直接使用；未启用快速校验时只检查文件存在且不为空
+        if self.validator:
+            return self.validator.is_valid(path, expected_size)
+        # 远端记录的大小为 0 的文件（如 .gitkeep）本来就是空文件
+        return os.path.exists(path) and (os.path.getsize(path) > 0 or expected_size == 0)
+
+    def create_mirrors(self):
+        # 每类地址按顺序配置多个镜像，第一个以外的地址只在更快或前面的镜像不可用时使用。
+        # 镜像列表未变化时保留已记录的健康状态和测速结果
+        defaults = {
+            "civitai_api": CIVITAI_API_URL,
+            "civitai_files": CIVITAI_FILES_URL,
+            "huggingface_api": hf_constants.ENDPOINT,
+            "huggingface_files": hf_constants.ENDPOINT,
+        }
+        cooldown = self.config.getfloat('mirrors', 'cooldown', fallback=60)
+        probe_interval = self.config.getfloat('mirrors', 'probe_interval', fallback=600)
+        mirrors = {}
+        for name, origin in defaults.items():
+            urls = [url.strip().rstrip('/') for url in self.config.get('mirrors', name, fallback='').split(',') if url.strip()]
+            urls = urls or [origin]
+            pool = self.mirrors.get(name)
+            if pool is None or pool.urls != urls:
+                pool = MirrorPool(name, urls, origin)
+            pool.cooldown = cooldown
+            pool.probe_interval = probe_interval
+            mirrors[name] = pool
+        return mirrors
+
+    def get_file_mirrors(self, url):
+        # 下载地址指向官方文件服务器时，返回可以改写为镜像地址的镜像组
+        for name in ("civitai_files", "huggingface_files"):
+            pool = self.mirrors[name]
+            if pool.matches(url) and pool.urls != [pool.origin]:
+                return pool
+        return None
 
-    def create_session(self):
+    def get_mirror_stats(self):
+        return {name: pool.stats() for name, pool in self.mirrors.items()}
+
+    def get_metrics(self):
+        return dict(self.telemetry.snapshot(), metadata_cache=self.metadata_cache.stats(),
+                    scheduler=self.scheduler.stats(), bytes_transferred=self.bytes_transferred)
+
+    def get_manifest_path(self):
+        path = self.config.get('manifest', 'path', fallback='') or 'model_manifest.json'
+        return path if os.path.isabs(path) else os.path.join(self.get_root_dir(), path)
+
+    def get_pool_size(self):
+        # 每个主机的连接池大小：多个文件同时下载且每个文件使用多个连接时都需要各自的槽位
+        pool_size = self.config.getint('download', 'pool_maxsize', fallback=0)
+        return pool_size or max(10, self.download_connections * self.max_workers)
+
+    def create_session(self, retry=True):
         session = requests.Session()
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504])
-        session.mount('https://', HTTPAdapter(max_retries=retries))
+        # 不重试的会话用于有多个镜像的请求，由 MirrorPool 负责切换镜像和重试，
+        # 避免在已经不可用的镜像上按退避时间重试数十秒
+        retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504]) if retry else 0
+        pool_size = self.get_pool_size()
+        adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         return session
     
     def sanitize_repo_id(self, repo_id):
@@ -54,101 +404,84 @@ class ModelDownloader:
         repo_id = re.sub(r'^[\-.]+|[\-.]+$', '', repo_id)
         return repo_id[:96]
 
-    def get_model_name(self, source, model_id):
+    def get_model_name(self, source, model_id, model_info=None):
         if source == "huggingface":
             return self.sanitize_repo_id(model_id.split('/')[-1])
         elif source == "civitai":
-            model_info = self.civitai.get_model(model_id)
+            if not isinstance(model_info, dict):
+                model_info = self.civitai.get_model(model_id)
             return model_info.get('name', model_id)
         else:
             return model_id
 
-    def download_from_huggingface(self, model_type, model_id, local_dir, download_url, file_names=None):
+    def get_hf_local_path(self, local_dir, model_id, file):
+        # 保留原始文件名和扩展名，只在前面添加模型ID
+        original_filename = os.path.basename(file)
+        return os.path.join(local_dir, self.sanitize_filename(f"[{model_id}]{original_filename}"))
+
+    def download_from_huggingface(self, model_type, model_id, local_dir, download_url, file_names=None, progress_callback=None, repo_files=None):
         logging.info(f"从Hugging Face下载{model_type}模型: {model_id}")
         try:
-            files = file_names if file_names else self.hf_api.list_repo_files(model_id)
-            downloaded_files = []
-            for file in files:
-                file_url = hf_hub_url(model_id, filename=file)
-                # 保留原始文件名和扩展名，只在前面添加模型ID
-                original_filename = os.path.basename(file)
-                file_name = self.sanitize_filename(f"[{model_id}]{original_filename}")
-                file_local_path = os.path.join(local_dir, file_name)
-                os.makedirs(os.path.dirname(file_local_path), exist_ok=True)
-                
-                headers = {}
-                if self.huggingface_token:
-                    headers['Authorization'] = f'Bearer {self.huggingface_token}'
+            # 仓库文件列表包含每个文件的大小和 LFS 文件的 SHA256
+            repo_files = {f['path']: f for f in (repo_files if repo_files is not None else self.huggingface.list_repo_tree(model_id))}
+            files = file_names if file_names else list(repo_files)
+            local_paths = [self.get_hf_local_path(local_dir, model_id, file) for file in files]
+            os.makedirs(local_dir, exist_ok=True)
 
-                response = self.session.get(file_url, stream=True, headers=headers)
-                if response.status_code != 200:
-                    raise Exception(f"Failed to download file {file}: {response.status_code}")
+            # 逐个跳过本地已存在的文件，只下载缺失的文件
+            missing = [(file, path) for file, path in zip(files, local_paths)
+                       if not self.is_complete(path, repo_files.get(file, {}).get('size'))]
+            if not missing:
+                return local_paths
 
-                total_size = int(response.headers.get('content-length', 0))
-                
-                with open(file_local_path, 'wb') as f, tqdm(
-                    desc=f"下载 {file}",
-                    total=total_size,
-                    unit='iB',
-                    unit_scale=True,
-                    unit_divisor=1024,
-                ) as progress_bar:
-                    for data in response.iter_content(chunk_size=8192):
-                        size = f.write(data)
-                        progress_bar.update(size)
-                        if self.progress_callback:
-                            self.progress_callback(progress_bar.n / total_size * 100)
-                
+            headers = {}
+            if self.huggingface_token:
+                headers['Authorization'] = f'Bearer {self.huggingface_token}'
+
+            sizes = {file: repo_files[file]['size'] for file, _ in missing if repo_files.get(file, {}).get('size')}
+            check_free_space(local_dir, sum(sizes.values()), self.min_free_space)
+            progress = AggregateProgress(self.make_progress_reporter(progress_callback), sizes)
+            job = self.scheduler.current_job()
+
+            def download(file, file_local_path):
+                file_url = hf_hub_url(model_id, filename=file)
+                lfs = repo_files.get(file, {}).get('lfs') or {}
+                with self.scheduler.job_context(job):
+                    self.download_file(file_url, file_local_path, headers=headers, desc=f"下载 {file}",
+                                       on_progress=lambda n, total: progress.update(file, n, total),
+                                       expected_sha256=lfs.get('oid'), expected_size=repo_files.get(file, {}).get('size'))
                 logging.info(f"下载完成: {file_local_path}")
-                downloaded_files.append(file_local_path)
+
+            errors = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(download, file, path): file for file, path in missing}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"下载文件 {futures[future]} 失败: {e}")
+                        errors[futures[future]] = e
+            cancelled = next((e for e in errors.values() if isinstance(e, DownloadCancelledError)), None)
+            if cancelled:
+                raise cancelled
+            if errors:
+                details = "\n".join(f"{file}: {e}" for file, e in errors.items())
+                raise ValueError(f"{len(errors)}/{len(missing)} 个文件下载失败:\n{details}")
         except Exception as e:
             logging.error(f"从Hugging Face下载模型时出错: {e}")
             raise
-        return downloaded_files
-    
-    def download_from_civitai(self, model_type, model_id, local_path, download_url):
+        return local_paths
+
+    def download_from_civitai(self, model_type, model_id, local_path, download_url, expected_sha256=None, progress_callback=None, expected_size=None):
         logging.info(f"从Civitai下载{model_type}模型: {model_id}")
         try:
             headers = {}
             if self.civitai_api_key:
                 headers['Authorization'] = f'Bearer {self.civitai_api_key}'
 
-            response = self.session.get(download_url, stream=True, verify=False, headers=headers)  # 忽略 SSL 验证
-
-            if response.status_code == 401:
-                error_message = (
-                    f"下载 Civitai 模型 {model_id} 时遇到 401 Unauthorized 错误。\n"
-                    "可能的原因：\n"
-                    "1. 该模型可能需要登录才能下载。\n"
-                    "2. 您可能需要在 Civitai 上购买或获得该模型的访问权限。\n"
-                    "3. Civitai 的 API 可能发生了变化。\n"
-                    "建议解决方法：\n"
-                    "1. 请尝试手动从 Civitai 网站下载模型，然后将其放置在正确的目录中。\n"
-                    "2. 检查 Civitai 的 API 文档，看是否需要提供额外的认证信息。"
-                )
-                logging.error(error_message)
-                raise ValueError(error_message)
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to download model: {response.status_code}")
-
-            total_size = int(response.headers.get('content-length', 0))
-            
-            with open(local_path, 'wb') as file, tqdm(
-                desc=f"下载 {model_id}",
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as progress_bar:
-                for data in response.iter_content(chunk_size=8192):
-                    size = file.write(data)
-                    progress_bar.update(size)
-                    if self.progress_callback:
-                        self.progress_callback(progress_bar.n / total_size * 100)
-            
-            if os.path.getsize(local_path) == 0:
-                raise ValueError(f"下载完成，但文件大小为0: {local_path}")
+            self.download_file(download_url, local_path, headers=headers, desc=f"下载 {model_id}", verify=False,  # 忽略 SSL 验证
+                               on_progress=self.make_progress_reporter(progress_callback), expected_sha256=expected_sha256,
+                               expected_size=expected_size)
             
             logging.info(f"下载完成: {local_path}")
         except requests.exceptions.HTTPError as e:
@@ -163,20 +496,494 @@ class ModelDownloader:
             elif e.response.status_code == 404:
                 error_message += "404 Not Found 错误可能意味着模型不存在或已被删除。请检查模型 ID 是否正确。"
             logging.error(error_message)
-            if os.path.exists(local_path):
-                os.remove(local_path)
-            raise ValueError(error_message)
+            # 只有无权访问、文件不存在或远端文件已变化时临时文件才没有用；
+            # 500、502、429 等临时错误保留临时文件，下次从断点继续
+            if e.response is None or e.response.status_code in (401, 403, 404, 412, 416):
+                self.discard_partial_download(local_path)
+                raise ValueError(error_message)
+            raise
         except Exception as e:
             logging.error(f"从Civitai下载模型时出错: {e}")
-            if os.path.exists(local_path):
-                os.remove(local_path)
             raise
         return local_path
 
+    def discard_partial_download(self, local_path):
+        for path in (f"{local_path}.part", f"{local_path}.part.json"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def read_part_meta(self, meta_path):
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def count_transferred(self, size):
+        with self.transferred_lock:
+            self.bytes_transferred += size
+
+    def make_progress_reporter(self, progress_callback=None):
+        progress_callback = progress_callback or self.progress_callback
+
+        def report_progress(downloaded, total):
+            if progress_callback and total:
+                progress_callback(min(downloaded / total * 100, 100))
+        return report_progress
+
+    def download_file(self, url, local_path, headers=None, desc=None, verify=True, on_progress=None, expected_sha256=None, expected_size=None):
+        # 每个文件的字节数、速度和状态汇总到所属下载任务的进度中
+        job = self.scheduler.current_job()
+        name = os.path.basename(local_path)
+        report = on_progress or self.make_progress_reporter()
+
+        def on_file_progress(downloaded, total):
+            self.progress.update(job, name, downloaded, total, "downloading")
+            report(downloaded, total)
+
+        self.progress.update(job, name, state="queued")
+        try:
+            # 不同的请求可能指向同一个目标文件，按文件加锁避免并发写入同一个 .part 文件
+            with self.locks.hold(os.path.relpath(os.path.abspath(local_path), self.get_models_dir())):
+                if self.is_complete(local_path, expected_size):
+                    logging.info(f"文件已由其他请求下载完成: {local_path}")
+                else:
+                    if os.path.exists(local_path):
+                        # 不完整的文件不能再作为相同哈希的副本链接到其他位置
+                        forget_corrupted(self.manifest, self.blob_store, local_path)
+                    self.download_file_locked(url, local_path, headers, desc, verify, on_file_progress, expected_sha256, expected_size)
+        except DownloadCancelledError:
+            logging.info(f"下载已取消，已保留临时文件以便下次续传: {local_path}.part")
+            self.progress.update(job, name, state="cancelled")
+            raise
+        except Exception:
+            self.progress.update(job, name, state="failed")
+            raise
+        self.progress.update(job, name, state="done")
+        return local_path
+
+    def download_file_locked(self, url, local_path, headers=None, desc=None, verify=True, on_progress=None, expected_sha256=None, expected_size=None):
+        job = self.scheduler.current_job()
+        if expected_sha256 and self.link_from_store(expected_sha256, local_path):
+            self.telemetry.add(job, "store_links")
+            return local_path
+
+        # 先写入 .part 临时文件，中断后通过 Range 请求续传，完整后再原子地重命名为目标文件
+        part_path = f"{local_path}.part"
+        meta_path = f"{part_path}.json"
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        hasher = StreamingHasher()
+        desc = desc or f"下载 {os.path.basename(local_path)}"
+        on_progress = on_progress or self.make_progress_reporter()
+        mirrors = self.get_file_mirrors(url)
+        # 有多个镜像时由下面的循环负责重试和切换镜像
+        session, timeout = (self.failover_session, self.failover_timeout) if mirrors else (self.session, self.download_timeout)
+        if mirrors:
+            mirrors.probe(session, timeout[0])
+
+        for attempt in range(self.download_retries + 1):
+            # 每次尝试都选择当前最快的可用镜像，中途切换镜像时从已下载的位置继续
+            mirror = mirrors.select() if mirrors else None
+            attempt_url = mirrors.rewrite(url, mirror) if mirrors else url
+            self.telemetry.add_mirror(job, urlparse(attempt_url).netloc)
+            meter = ThroughputMeter(on_progress)
+            try:
+                if not (self.download_connections > 1 and
+                        self.download_segmented(attempt_url, part_path, meta_path, headers or {}, desc, verify,
+                                                meter.update, hasher, expected_sha256, session, timeout)):
+                    self.download_part(attempt_url, part_path, meta_path, headers or {}, desc, verify,
+                                       meter.update, hasher, expected_sha256, session, timeout)
+                if mirror:
+                    meter.record(mirrors, mirror)
+                    mirrors.record_success(mirror)
+                break
+            except (requests.exceptions.HTTPError, requests.exceptions.RetryError) as e:
+                if not (mirrors and is_failover_error(e) and attempt < self.download_retries):
+                    raise
+                mirrors.record_failure(mirror, e)
+                self.telemetry.add(job, "mirror_failovers")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, IncompleteDownloadError, StreamInterruptedError) as e:
+                if mirror:
+                    meter.record(mirrors, mirror)
+                    mirrors.record_failure(mirror, e)
+                if attempt >= self.download_retries:
+                    logging.error(f"下载失败，已保留临时文件以便下次续传: {part_path}")
+                    raise
+                self.telemetry.add(job, "resume_retries")
+                if mirrors and mirrors.select() is not mirror:
+                    self.telemetry.add(job, "mirror_failovers")
+                    logging.warning(f"下载中断，切换到镜像 {mirrors.select().url} 继续 ({attempt + 1}/{self.download_retries}): {e}")
+                    continue
+                wait = min(2 ** attempt, 30)
+                logging.warning(f"下载中断，{wait} 秒后从断点继续 ({attempt + 1}/{self.download_retries}): {e}")
+                time.sleep(wait)
+
+        size = os.path.getsize(part_path)
+        # 远端记录或服务器返回的大小为 0 时（如仓库中的 .gitkeep），空文件是正常的下载结果
+        if size == 0 and expected_size != 0 and self.read_part_meta(meta_path).get('total') != 0:
+            self.discard_partial_download(local_path)
+            raise ValueError(f"下载完成，但文件大小为0: {local_path}")
+
+        # 流式计算时哈希已基本完成，这里只补上续传前或分段下载未连续的部分
+        with self.telemetry.phase(job, "hash"):
+            hasher.catch_up(part_path, size)
+        sha256 = hasher.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            self.discard_partial_download(local_path)
+            error_message = f"SHA256 校验失败，文件可能已损坏: {local_path}\n期望: {expected_sha256.lower()}\n实际: {sha256}"
+            logging.error(error_message)
+            raise ValueError(error_message)
+        if expected_sha256:
+            logging.info(f"SHA256 校验通过: {local_path}")
+
+        os.replace(part_path, local_path)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        if self.blob_store:
+            self.blob_store.ingest(local_path, sha256)
+        self.manifest.record_hash(local_path, sha256, verified=bool(expected_sha256))
+        return local_path
+
+    def link_from_store(self, sha256, local_path):
+        # 下载前先按哈希查找内容存储，已有相同文件时直接链接，不再重复下载
+        if not self.blob_store:
+            return False
+        sha256 = sha256.lower()
+        if not self.blob_store.has(sha256):
+            # 启用存储之前下载的文件也可以通过清单中记录的哈希找到
+            existing_path = self.manifest.find_by_hash(sha256)
+            if not existing_path:
+                return False
+            self.blob_store.ingest(existing_path, sha256)
+        self.blob_store.link(sha256, local_path)
+        self.manifest.record_hash(local_path, sha256, verified=True)
+        logging.info(f"内容存储中已有相同文件，直接链接: {local_path}")
+        return True
+
+    @contextmanager
+    def track_transfer(self, job, transfer, response):
+        # 记录一次 HTTP 传输的排队、建立连接（到收到响应头为止）和传输耗时，
+        # 以及连接池层面的重试次数；被抢占后重新排队的时间不计入传输耗时
+        started, waited = time.monotonic(), transfer.waited
+        try:
+            yield
+        finally:
+            finished = time.monotonic()
+            self.telemetry.add_phase(job, "queue", transfer.waited)
+            self.telemetry.add_phase(job, "connect", response.elapsed.total_seconds())
+            self.telemetry.add_phase(job, "transfer", finished - started - (transfer.waited - waited))
+            self.telemetry.add(job, "http_retries", get_retry_count(response))
+            self.telemetry.mark_transfer(job, started, finished)
+
+    def download_segmented(self, url, part_path, meta_path, headers, desc, verify, on_progress, hasher, expected_sha256=None, session=None, timeout=None):
+        # 多连接分段下载：把文件按字节区间拆分，并发下载后写入预分配文件的对应位置。
+        # 服务器不支持 Range 或文件太小时返回 False，由调用方改用单连接下载
+        meta = self.read_part_meta(meta_path)
+        if os.path.exists(part_path) and meta and 'segment_size' not in meta:
+            # 已有单连接下载的临时文件，继续单连接续传
+            return False
+
+        session = session or self.session
+        timeout = timeout or self.download_timeout
+        request_headers = dict(headers)
+        request_headers['Accept-Encoding'] = 'identity'
+        probe = session.get(url, stream=True, headers=dict(request_headers, Range='bytes=0-0'),
+                            verify=verify, timeout=timeout)
+        with probe:
+            if probe.status_code == 416:
+                # 空文件没有可请求的字节范围，交给单连接下载
+                return False
+            probe.raise_for_status()
+            match = re.match(r'bytes 0-0/(\d+)', probe.headers.get('Content-Range', ''))
+            if probe.status_code != 206 or not match:
+                logging.info(f"服务器不支持 Range 请求，使用单连接下载: {url}")
+                return False
+            total = int(match.group(1))
+            etag = probe.headers.get('ETag')
+            last_modified = probe.headers.get('Last-Modified')
+            # 直接请求重定向后的地址，避免每个分段都重新经过 API 跳转
+            final_url = probe.url
+        if total < self.min_segmented_size:
+            return False
+        if urlparse(final_url).netloc != urlparse(url).netloc:
+            request_headers.pop('Authorization', None)
+
+        segment_size = self.segment_size
+        segments = [(start, min(start + segment_size, total) - 1) for start in range(0, total, segment_size)]
+        same_version = (etag or last_modified) and meta.get('etag') == etag and meta.get('last_modified') == last_modified
+        # 不同镜像的 ETag 可能不同；已知 SHA256 时完成后会校验整个文件，可以沿用其他镜像下载的分段
+        switched_mirror = bool(expected_sha256) and urlparse(meta.get('url', '')).netloc != urlparse(url).netloc
+        same_file = ((same_version or switched_mirror)
+                     and meta.get('total') == total and meta.get('segment_size') == segment_size)
+        if os.path.exists(part_path) and same_file:
+            done = set(meta.get('segments', []))
+            # 未完成分段已写入的字节数，从中断的位置继续，不必重新下载整个分段
+            received = {int(index): size for index, size in (meta.get('received') or {}).items()
+                        if int(index) < len(segments) and int(index) not in done}
+            # 已经写完、但还没来得及标记为完成的分段
+            done.update(index for index, size in received.items() if size >= segments[index][1] - segments[index][0] + 1)
+            received = {index: size for index, size in received.items() if index not in done}
+            logging.info(f"继续分段下载，已完成 {len(done)}/{len(segments)} 段: {part_path}")
+        else:
+            done = set()
+            received = {}
+            hasher.reset()
+            check_free_space(os.path.dirname(part_path) or '.', total, self.min_free_space)
+            with open(part_path, 'wb') as f:
+                preallocate(f, 0, total)
+
+        lock = threading.Lock()
+        hash_lock = threading.Lock()
+        abort = threading.Event()
+        job = self.scheduler.current_job()
+
+        def hashed_prefix_end():
+            # 从文件开头起连续完成的分段末尾
+            index = 0
+            while index in done:
+                index += 1
+            return segments[index - 1][1] + 1 if index else 0
+
+        def save_meta():
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "url": url,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "total": total,
+                    "segment_size": segment_size,
+                    "segments": sorted(done),
+                    "received": {str(index): size for index, size in received.items() if size},
+                }, f)
+
+        def record_received(index, file):
+            file.flush()
+            with lock:
+                received[index] = file.tell() - segments[index][0]
+                save_meta()
+
+        def fetch(index, throttle):
+            start, end = segments[index]
+            offset = received.get(index, 0)
+            segment_headers = dict(request_headers, Range=f'bytes={start + offset}-{end}')
+            recorded_at = [time.monotonic()]
+            # 每个分段连接都作为一个传输参与调度，排队期间不占用连接
+            with self.scheduler.transfer(final_url, job) as transfer, \
+                    session.get(final_url, stream=True, headers=segment_headers, verify=verify,
+                                timeout=timeout) as response, \
+                    self.track_transfer(job, transfer, response):
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IncompleteDownloadError(f"服务器没有按分段返回数据: {response.status_code}")
+
+                def on_chunk(chunk):
+                    throttle.add(len(chunk))
+                    transfer.consume(len(chunk))
+                    # 定期记录分段已写入的位置，连接中断或进程退出后从这里继续
+                    now = time.monotonic()
+                    if now - recorded_at[0] >= self.progress_interval:
+                        recorded_at[0] = now
+                        record_received(index, file)
+
+                with open(part_path, 'r+b') as file:
+                    file.seek(start + offset)
+                    try:
+                        written = copy_stream(response, file, self.buffer_size, on_chunk, abort.is_set)
+                    finally:
+                        record_received(index, file)
+            if abort.is_set():
+                return
+            if offset + written != end - start + 1:
+                raise IncompleteDownloadError(f"分段 {start}-{end} 下载不完整: {offset + written} 字节")
+            with lock:
+                done.add(index)
+                received.pop(index, None)
+                save_meta()
+                prefix_end = hashed_prefix_end()
+            # 分段无法按顺序流式计算哈希，只能在前缀连续后从页缓存中读回
+            with hash_lock, self.telemetry.phase(job, "hash"):
+                if prefix_end > hasher.offset:
+                    hasher.catch_up(part_path, prefix_end)
+
+        with lock:
+            save_meta()
+        pending = [i for i in range(len(segments)) if i not in done]
+        initial = sum(segments[i][1] - segments[i][0] + 1 for i in done) + sum(received.values())
+        with tqdm(
+            desc=desc,
+            total=total,
+            initial=initial,
+            unit='iB',
+            unit_scale=True,
+            unit_divisor=1024,
+        ) as progress_bar, ThreadPoolExecutor(max_workers=self.download_connections) as executor:
+            # 进度条可能被 TQDM_DISABLE 禁用，已下载的字节数单独统计
+            downloaded = [initial]
+
+            def report(size):
+                self.count_transferred(size)
+                self.telemetry.add(job, "bytes", size)
+                with lock:
+                    progress_bar.update(size)
+                    downloaded[0] += size
+                    on_progress(downloaded[0], total)
+
+            on_progress(initial, total)
+            throttle = ProgressThrottle(report, self.progress_interval)
+            futures = [executor.submit(fetch, i, throttle) for i in pending]
+            errors = []
+            try:
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except (requests.exceptions.RequestException, IncompleteDownloadError, StreamInterruptedError) as e:
+                        # 一个分段的网络错误不影响其他分段，其余分段继续下载；
+                        # 失败的分段已记录写入位置，重试时只请求剩余的范围
+                        errors.append(e)
+            except BaseException:
+                abort.set()
+                raise
+            finally:
+                throttle.flush()
+
+        if errors:
+            logging.warning(f"{len(errors)} 个分段下载中断，已完成 {len(done)}/{len(segments)} 段: {part_path}")
+            raise errors[0]
+        if len(done) != len(segments):
+            raise IncompleteDownloadError(f"分段下载不完整: {len(done)}/{len(segments)} 段")
+        return True
+
+    def download_part(self, url, part_path, meta_path, headers, desc, verify, on_progress, hasher, expected_sha256=None, session=None, timeout=None):
+        session = session or self.session
+        timeout = timeout or self.download_timeout
+        meta = self.read_part_meta(meta_path)
+        if 'segment_size' in meta:
+            # 分段下载留下的临时文件已预分配到完整大小，只有从开头起连续完成的分段可以续传
+            done = set(meta.get('segments', []))
+            index = 0
+            while index in done:
+                index += 1
+            # 连续分段之后的那个分段如果已下载了一部分，也可以沿用
+            written = index * meta['segment_size'] + (meta.get('received') or {}).get(str(index), 0)
+            meta = dict(meta, preallocated=True, written=min(written, meta.get('total') or 0))
+            logging.info(f"改用单连接下载，从已完成的连续分段末尾 {meta['written']} 字节处继续: {part_path}")
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if meta.get('preallocated'):
+            # 预分配的文件大小不代表已写入的数据量，以记录的写入位置为准
+            offset = min(offset, meta.get('written', 0))
+        # If-Range 只接受强 ETag，否则退回到 Last-Modified
+        etag = meta.get('etag')
+        validator = etag if etag and not etag.startswith('W/') else meta.get('last_modified')
+
+        # 切换到其他镜像后，原来的 ETag 不一定适用；已知 SHA256 时直接续传，完成后校验整个文件
+        switched_mirror = urlparse(meta.get('url', '')).netloc != urlparse(url).netloc
+
+        request_headers = dict(headers)
+        request_headers['Accept-Encoding'] = 'identity'
+        if offset and validator and not switched_mirror:
+            request_headers['Range'] = f'bytes={offset}-'
+            request_headers['If-Range'] = validator
+        elif offset and expected_sha256 and meta.get('total'):
+            request_headers['Range'] = f'bytes={offset}-'
+        else:
+            offset = 0
+
+        job = self.scheduler.current_job()
+        with self.scheduler.transfer(url, job) as transfer, \
+                session.get(url, stream=True, headers=request_headers, verify=verify,
+                            timeout=timeout) as response, \
+                self.track_transfer(job, transfer, response):
+            if response.status_code == 416:
+                if offset and offset == meta.get('total'):
+                    logging.info(f"临时文件已完整，无需续传: {part_path}")
+                    return
+                os.remove(part_path)
+                raise IncompleteDownloadError(f"续传位置无效，将重新下载: {part_path}")
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+                if not match or int(match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise IncompleteDownloadError(f"服务器返回的续传范围不匹配，将重新下载: {part_path}")
+                total = int(match.group(2)) if match.group(2) != '*' else None
+                if meta.get('total') and total and total != meta['total']:
+                    os.remove(part_path)
+                    raise IncompleteDownloadError(f"远端文件大小已变化，将重新下载: {part_path}")
+                logging.info(f"从 {offset} 字节处继续下载: {part_path}")
+            else:
+                if offset:
+                    logging.info(f"服务器不支持续传或文件已变化，重新下载: {part_path}")
+                offset = 0
+                # 服务器没有返回 Content-Length 时大小未知，记为 None，与明确返回的 0 区分
+                content_length = response.headers.get('content-length')
+                total = int(content_length) if content_length is not None else None
+
+            preallocated = bool(total) and (not offset or bool(meta.get('preallocated')))
+            part_meta = {
+                "url": url,
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+                "total": total,
+                "preallocated": preallocated,
+                "written": offset,
+            }
+
+            def save_meta():
+                with open(meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(part_meta, f)
+
+            if total and not (offset and meta.get('preallocated')):
+                check_free_space(os.path.dirname(part_path) or '.', total - offset, self.min_free_space)
+            save_meta()
+
+            hasher.catch_up(part_path, offset)
+            with open(part_path, 'r+b' if offset else 'w+b') as file, tqdm(
+                desc=desc,
+                total=total or None,
+                initial=offset,
+                unit='iB',
+                unit_scale=True,
+                unit_divisor=1024,
+            ) as progress_bar:
+                if preallocated and not offset:
+                    preallocate(file, 0, total)
+                file.seek(offset)
+                on_progress(offset, total)
+
+                def report(size):
+                    self.count_transferred(size)
+                    self.telemetry.add(job, "bytes", size)
+                    progress_bar.update(size)
+                    # 定期记录已写入的位置，续传时从这里继续；不使用进度条的计数，它可能被 TQDM_DISABLE 禁用
+                    file.flush()
+                    part_meta['written'] += size
+                    on_progress(part_meta['written'], total)
+                    save_meta()
+
+                throttle = ProgressThrottle(report, self.progress_interval)
+
+                def on_chunk(chunk):
+                    hasher.update(chunk)
+                    throttle.add(len(chunk))
+                    transfer.consume(len(chunk))
+
+                try:
+                    written = copy_stream(response, file, self.buffer_size, on_chunk)
+                finally:
+                    throttle.flush()
+                if not preallocated:
+                    file.truncate(offset + written)
+
+        if total and offset + written != total:
+            raise IncompleteDownloadError(f"下载不完整: {offset + written}/{total} 字节")
+
     def get_download_url(self, source, model_id, model_info, version_id=None):
         if source == "huggingface":
             try:
-                files = self.hf_api.list_repo_files(model_id)
+                files = [f['path'] for f in model_info] if isinstance(model_info, list) else \
+                    [f['path'] for f in self.huggingface.list_repo_tree(model_id)]
                 model_file = next((f for f in files if f.endswith(('.safetensors', '.ckpt', '.pt', '.bin'))), None)
                 if model_file:
                     return hf_hub_url(model_id, filename=model_file)
@@ -192,7 +999,7 @@ class ModelDownloader:
                 
                 version = self.get_model_version(model_info, version_id)
                 if version and version.get('files'):
-                    model_file = next((f for f in version['files'] if f.get('type') == 'Model'), None)
+                    model_file = self.get_civitai_model_file(version)
                     download_url = model_file.get('downloadUrl') if model_file else None
                     if download_url:
                         logging.info(f"成功获取Civitai模型 {model_id} 版本 {version.get('id')} 的下载链接")
@@ -207,11 +1014,40 @@ class ModelDownloader:
         logging.error(f"无法获取模型 {model_id} 的下载链接")
         raise ValueError(f"无法获取模型 {model_id} 的下载链接")
 
-    def get_model_info(self, source, model_id):
+    def get_civitai_version_info(self, model_id, version_id):
+        # 指定版本时只请求该版本的信息，避免下载包含所有版本和图片的完整模型文档
+        try:
+            version = self.civitai.get_model_version(version_id)
+        except requests.exceptions.HTTPError as e:
+            logging.warning(f"获取Civitai模型版本 {version_id} 信息失败，将使用完整模型信息: {e}")
+            return None
+        if str(version.get('modelId')) != str(model_id):
+            logging.warning(f"版本 {version_id} 不属于模型 {model_id}，将使用完整模型信息")
+            return None
+        logging.info(f"成功获取Civitai模型 {model_id} 版本 {version_id} 的信息")
+        return {
+            "id": version.get('modelId'),
+            "name": (version.get('model') or {}).get('name', model_id),
+            "modelVersions": [version],
+        }
+
+    def get_civitai_model_file(self, version):
+        return next((f for f in (version or {}).get('files', []) if f.get('type') == 'Model'), None)
+
+    def get_model_info(self, source, model_id, version_id=None):
         if source == "huggingface":
-            return f"Hugging Face模型: {model_id}"
+            try:
+                # Hugging Face 的模型信息即仓库文件列表，每次下载只请求一次
+                return self.huggingface.list_repo_tree(model_id)
+            except Exception as e:
+                logging.error(f"获取Hugging Face仓库 {model_id} 文件列表时出错: {e}")
+                raise ValueError(f"获取Hugging Face仓库 {model_id} 文件列表时出错: {e}")
         elif source == "civitai":
             try:
+                if version_id:
+                    model_info = self.get_civitai_version_info(model_id, version_id)
+                    if model_info:
+                        return model_info
                 model_info = self.civitai.get_model(model_id)
                 logging.info(f"成功获取Civitai模型 {model_id} 的信息")
                 return model_info
@@ -224,7 +1060,7 @@ class ModelDownloader:
     def get_file_extension(self, source, model_info, download_url):
         if source == "huggingface":
             try:
-                files = self.hf_api.list_repo_files(model_info)
+                files = [f['path'] for f in model_info]
                 model_file = next((f for f in files if f.endswith(('.safetensors', '.ckpt', '.pt', '.bin'))), None)
                 if model_file:
                     return os.path.splitext(model_file)[-1]
@@ -281,15 +1117,7 @@ class ModelDownloader:
             }
 
     def download_preview_image(self, image_url, local_path):
-        try:
-            response = self.session.get(image_url, stream=True, verify=False)  # 忽略 SSL 验证
-            response.raise_for_status()
-            with open(local_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            logging.info(f"预览图片下载完成: {local_path}")
-        except Exception as e:
-            logging.error(f"下载预览图片时出错: {e}")
+        return self.previews.fetch(image_url, local_path)
 
     def get_model_version(self, model_info, version_id=None):
         if not model_info.get('modelVersions'):
@@ -309,54 +1137,138 @@ class ModelDownloader:
         # 如果没有指定版本或找不到指定版本，使用最新版本
         return version or model_info['modelVersions'][0]
 
-    def ensure_downloaded(self, model_type, model_id, source, base_model, version_id=None, file_names=None):
-        model_info = self.get_model_info(source, model_id)
-        model_name = self.get_model_name(source, model_id)
-        version = None
-        
-        if source == "civitai":
-            download_url, version = self.get_download_url(source, model_id, model_info, version_id)
-            version_name = version.get('name', '')
-            version_id = version.get('id', '')
-            # 使用版本名称和ID组合作为版本标识
-            version_str = f"_v{version_id}"
-            if version_name:
-                version_str += f"_{self.sanitize_filename(version_name)}"
-        else:
-            download_url = self.get_download_url(source, model_id, model_info)
-            version_str = ""
+    def is_usable(self, entry):
+        return bool(entry) and (self.offline or not self.manifest.is_stale(entry, self.manifest_ttl))
+
+    def get_manifest_key(self, model_type, model_id, source, base_model, version_id=None, file_names=None):
+        # 参数顺序与 ensure_downloaded 一致；同时也是该模型下载任务在调度器和下载指标中的标识
+        return self.manifest.make_key(model_type, source, model_id, base_model, version_id, file_names)
+
+    def lookup_entry(self, manifest_key):
+        # 清单中的文件还需要通过快速校验（大小和 safetensors 头部），校验结果按文件缓存
+        entry = self.manifest.lookup(manifest_key)
+        if entry and self.validator and not self.validator.check_entry(entry):
+            return None
+        return entry
+
+    def lookup_cached(self, model_type, model_id, source, base_model, version_id=None, file_names=None):
+        # 返回无需任何网络请求即可使用的本地清单条目
+        manifest_key = self.get_manifest_key(model_type, model_id, source, base_model, version_id, file_names)
+        entry = self.lookup_entry(manifest_key)
+        return entry if self.is_usable(entry) else None
+
+    def ensure_downloaded(self, model_type, model_id, source, base_model, version_id=None, file_names=None, progress_callback=None, priority=PRIORITY_INTERACTIVE, progress_listener=None, group=None):
+        manifest_key = self.get_manifest_key(model_type, model_id, source, base_model, version_id, file_names)
+        entry = self.lookup_entry(manifest_key)
+        if self.is_usable(entry):
+            logging.info(f"命中本地模型清单，跳过网络请求: {entry['relative_path']}")
+            self.manifest.touch(manifest_key)
+            self.telemetry.record_resolve("hit", job=manifest_key, source=source, model_type=model_type)
+            return entry['relative_path'], entry['model_details']
+        if self.offline:
+            raise ValueError(f"离线模式下本地模型清单中没有找到模型: {source} {model_id}")
+
+        # 同一模型的并发请求只由第一个调用者下载，其余调用者等待并共享结果；
+        # 等待者的优先级同样会作用到正在进行的下载上，也同样可以收到下载进度
+        with self.scheduler.request(manifest_key, priority, group), self.progress.watch(manifest_key, progress_listener):
+            return single_flight.do(manifest_key, lambda: self.ensure_downloaded_locked(
+                manifest_key, entry, model_type, model_id, source, base_model, version_id, file_names, progress_callback))
+
+    def ensure_downloaded_locked(self, manifest_key, entry, model_type, model_id, source, base_model, version_id=None, file_names=None, progress_callback=None):
+        # 从这里开始到返回为止的各阶段耗时、传输字节数和重试次数记录为一个下载事件
+        with self.telemetry.track(manifest_key, source=source, model_type=model_type, cache="miss") as metrics:
+            started = time.monotonic()
+            with self.locks.hold(manifest_key):
+                metrics.add_phase("lock", time.monotonic() - started)
+                # 等待锁的过程中，其他进程可能已经完成了下载
+                fresh_entry = self.lookup_entry(manifest_key)
+                if fresh_entry and not self.manifest.is_stale(fresh_entry, self.manifest_ttl):
+                    logging.info(f"其他进程已完成下载: {fresh_entry['relative_path']}")
+                    self.manifest.touch(manifest_key)
+                    self.telemetry.annotate(manifest_key, cache="hit")
+                    return fresh_entry['relative_path'], fresh_entry['model_details']
+                return self.refresh_manifest_entry(
+                    manifest_key, entry, model_type, model_id, source, base_model, version_id, file_names, progress_callback)
+
+    def refresh_manifest_entry(self, manifest_key, entry, model_type, model_id, source, base_model, version_id=None, file_names=None, progress_callback=None):
+        try:
+            relative_model_path, model_details, local_paths, preview_image_path, sizes = self.download_model(
+                model_type, model_id, source, base_model, version_id, file_names, progress_callback)
+        except DownloadCancelledError:
+            raise
+        except Exception as e:
+            if entry:
+                # 远端不可用时，继续使用清单中已过期但本地完整的条目
+                logging.warning(f"刷新模型信息失败，使用本地模型清单中的记录: {e}")
+                self.manifest.touch(manifest_key)
+                self.telemetry.annotate(manifest_key, cache="stale")
+                return entry['relative_path'], entry['model_details']
+            raise
+
+        self.manifest.put(manifest_key, local_paths, relative_model_path, model_details, preview_image_path, sizes)
+        return relative_model_path, model_details
+
+    def download_model(self, model_type, model_id, source, base_model, version_id=None, file_names=None, progress_callback=None):
+        with self.telemetry.phase(self.scheduler.current_job(), "metadata"):
+            model_info = self.get_model_info(source, model_id, version_id)
+            model_name = self.get_model_name(source, model_id, model_info)
+            version = None
+
+            if source == "civitai":
+                download_url, version = self.get_download_url(source, model_id, model_info, version_id)
+                version_name = version.get('name', '')
+                version_id = version.get('id', '')
+                # 使用版本名称和ID组合作为版本标识
+                version_str = f"_v{version_id}"
+                if version_name:
+                    version_str += f"_{self.sanitize_filename(version_name)}"
+            else:
+                download_url = self.get_download_url(source, model_id, model_info)
+                version_str = ""
         
         local_dir = os.path.join(self.model_types[model_type], base_model)
         os.makedirs(local_dir, exist_ok=True)
         
         if source == "huggingface":
-            expected_files = file_names if file_names else self.hf_api.list_repo_files(model_id)
-            local_paths = [os.path.join(local_dir, self.sanitize_filename(f"[{model_id}]{os.path.basename(f)}")) for f in expected_files]
+            expected_files = file_names if file_names else [f['path'] for f in model_info]
+            local_paths = [self.get_hf_local_path(local_dir, model_id, f) for f in expected_files]
             
-            # 检查文件是否已存在
-            missing_files = [f for f in local_paths if not os.path.exists(f) or os.path.getsize(f) == 0]
+            # 检查文件是否已存在且完整，只下载缺失或不完整的文件
+            sizes = {f['path']: f.get('size') for f in model_info}
+            missing_files = [f for f, path in zip(expected_files, local_paths) if not self.is_complete(path, sizes.get(f))]
             
             if missing_files:
-                local_paths = self.download_from_huggingface(model_type, model_id, local_dir, download_url, file_names)
+                # 下载前按磁盘配额清理最久未使用的模型
+                self.quota.make_room(model_type, sum(sizes.get(f) or 0 for f in missing_files), local_paths)
+                self.download_from_huggingface(model_type, model_id, local_dir, download_url, missing_files, progress_callback, model_info)
             else:
                 logging.info(f"模型文件已存在，跳过下载: {local_paths}")
             
             # 选择第一个文件作为主要模型文件
             main_model_path = local_paths[0] if local_paths else None
+            file_sizes = {path: sizes.get(f) for f, path in zip(expected_files, local_paths)}
         elif source == "civitai":
             file_extension = self.get_file_extension(source, model_info, download_url)
             filename = self.sanitize_filename(f"[{model_id}]{model_name}{version_str}{file_extension}")
             main_model_path = os.path.join(local_dir, filename)
             
-            if os.path.exists(main_model_path) and os.path.getsize(main_model_path) > 0:
+            model_file = self.get_civitai_model_file(version) or {}
+            # 没有 sizeKB 时大小未知，不能当作 0 字节的空文件
+            expected_size = int(model_file['sizeKB'] * 1024) if model_file.get('sizeKB') else None
+            if self.is_complete(main_model_path, expected_size):
                 logging.info(f"模型文件已存在，跳过下载: {main_model_path}")
             else:
-                main_model_path = self.download_from_civitai(model_type, model_id, main_model_path, download_url)
+                expected_sha256 = (model_file.get('hashes') or {}).get('SHA256')
+                self.quota.make_room(model_type, expected_size or 0, [main_model_path])
+                main_model_path = self.download_from_civitai(
+                    model_type, model_id, main_model_path, download_url, expected_sha256, progress_callback, expected_size)
+            local_paths = [main_model_path]
+            file_sizes = {main_model_path: expected_size}
         
-        if not main_model_path or not os.path.exists(main_model_path) or os.path.getsize(main_model_path) == 0:
+        if not main_model_path or not self.is_complete(main_model_path, file_sizes.get(main_model_path)):
             raise ValueError(f"下载失败或文件大小为0: {main_model_path}")
         
-        # 下载预览图片（无论模型是否已存在）
+        # 下载预览图片（无论模型是否已存在，在后台进行）
         preview_image_path = self.download_preview_image_if_available(source, model_id, model_info, local_dir, main_model_path, version_id)
         
         # 剔除 "models" 和模型类型目录
@@ -367,10 +1279,10 @@ class ModelDownloader:
         
         # 更新model_details以包含版本信息
         model_details = self.get_model_details(source, model_id, model_info, version)
-        return relative_model_path, model_details
+        return relative_model_path, model_details, local_paths, preview_image_path, file_sizes
 
     def download_preview_image_if_available(self, source, model_id, model_info, local_dir, model_path, version_id=None):
-        if source == "civitai":
+        if source == "civitai" and self.preview_enabled:
             version = self.get_model_version(model_info, version_id)
             if version and version.get('images'):
                 first_image = version['images'][0]
@@ -382,22 +1294,35 @@ class ModelDownloader:
                     image_filename = f"{model_name_without_ext}{image_extension}"
                     preview_image_path = os.path.join(local_dir, image_filename)
                     
-                    if not os.path.exists(preview_image_path):
-                        logging.info(f"预览图片不存在，开始下载: {preview_image_path}")
-                        self.download_preview_image(image_url, preview_image_path)
-                    else:
-                        logging.info(f"预览图片已存在: {preview_image_path}")
+                    # 预览图片在后台下载，节点无需等待即可返回模型路径
+                    if self.previews.submit(image_url, preview_image_path):
+                        logging.info(f"预览图片不存在，已加入后台下载: {preview_image_path}")
                     return preview_image_path
         return None
 
     def load_config(self):
         config = configparser.ConfigParser()
-        # 获取项目根目录路径（当前文件所在目录的上一级目录）
-        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        config_path = os.path.join(root_dir, 'config.ini')
+        root_dir = self.get_root_dir()
+        # 可以通过环境变量使用其他配置文件，例如在 ComfyUI 之外运行性能测试时
+        config_path = os.environ.get('MODEL_DOWNLOADER_CONFIG') or os.path.join(root_dir, 'config.ini')
+        self.config_path = config_path
         if os.path.exists(config_path):
+            self.config_mtime = os.path.getmtime(config_path)
             config.read(config_path)
         else:
             logging.error(f"找不到根目录下的配置文件: {config_path}")
             raise FileNotFoundError(f"配置文件 {config_path} 不存在。")
         return config
+
+_shared_downloader = None
+_shared_downloader_lock = threading.Lock()
+
+def get_model_downloader():
+    # 进程内共享同一个下载器，复用 HTTP 连接池；配置文件修改后才重新加载
+    global _shared_downloader
+    with _shared_downloader_lock:
+        if _shared_downloader is None:
+            _shared_downloader = ModelDownloader()
+        else:
+            _shared_downloader.reload_config_if_changed()
+        return _shared_downloader
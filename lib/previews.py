@@ -0,0 +1,147 @@
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import scheduler, PRIORITY_BACKGROUND
+from .telemetry import telemetry
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_executor = None
+_executor_workers = None
+_executor_lock = threading.Lock()
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def get_executor(max_workers):
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            # 重新加载配置后线程数变化时换用新的线程池，旧线程池执行完已提交的任务后退出
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_preview")
+            _executor_workers = max_workers
+        return _executor
+
+
+def get_thumbnail_url(image_url, max_size):
+    # Civitai 图片地址中带有 /width=450/ 或 /original=true/ 之类的参数段，改为按指定宽度由服务端缩放
+    if 'civitai.com' not in image_url:
+        return image_url
+    return re.sub(r'/(width=\d+|original=true)/', f'/width={max_size}/', image_url, count=1)
+
+
+def make_thumbnail(data, max_size):
+    # 安装了 Pillow 时在本地把图片缩放到指定尺寸以内；无法识别的格式（如视频）保持原样
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= max_size or getattr(image, 'is_animated', False):
+                return data
+            image_format = image.format
+            image.thumbnail((max_size, max_size))
+            output = io.BytesIO()
+            image.save(output, format=image_format)
+            return output.getvalue()
+    except Exception as e:
+        logging.debug(f"无法生成缩略图，保存原图: {e}")
+        return data
+
+
+# 在后台线程中下载模型预览图片并保存为限制尺寸的缩略图，不阻塞节点返回。
+# 下载失败的地址记录在磁盘上，在 retry_after 秒内不再重复请求
+class PreviewFetcher:
+    def __init__(self, session, timeout, failures_path, max_size=512, retry_after=86400, max_workers=2):
+        self.session = session
+        self.timeout = timeout
+        self.failures_path = failures_path
+        self.max_size = max_size
+        self.retry_after = retry_after
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.failures = self.load_failures()
+
+    def load_failures(self):
+        try:
+            with open(self.failures_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_failures(self):
+        try:
+            os.makedirs(os.path.dirname(self.failures_path) or '.', exist_ok=True)
+            tmp_path = f"{self.failures_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.failures, f)
+            os.replace(tmp_path, self.failures_path)
+        except OSError as e:
+            logging.warning(f"写入预览图片失败记录时出错: {e}")
+
+    def recently_failed(self, image_url):
+        with self.lock:
+            failed_at = self.failures.get(image_url)
+        return failed_at is not None and time.time() - failed_at < self.retry_after
+
+    def record_failure(self, image_url):
+        with self.lock:
+            now = time.time()
+            self.failures = {url: failed_at for url, failed_at in self.failures.items()
+                             if now - failed_at < self.retry_after}
+            self.failures[image_url] = now
+            self.save_failures()
+
+    def submit(self, image_url, local_path):
+        if os.path.exists(local_path) or self.recently_failed(image_url):
+            return None
+        with _pending_lock:
+            if local_path in _pending:
+                return None
+            _pending.add(local_path)
+
+        def run():
+            try:
+                self.fetch(image_url, local_path)
+            finally:
+                with _pending_lock:
+                    _pending.discard(local_path)
+
+        return get_executor(self.max_workers).submit(run)
+
+    def fetch(self, image_url, local_path):
+        started = time.monotonic()
+        data = b''
+        try:
+            # 预览图片以最低优先级下载，不与模型文件争抢带宽
+            with scheduler.request(f"preview:{image_url}", PRIORITY_BACKGROUND), \
+                    scheduler.transfer(image_url, f"preview:{image_url}") as transfer, \
+                    self.session.get(get_thumbnail_url(image_url, self.max_size), stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                data = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    data.extend(chunk)
+                    transfer.consume(len(chunk))
+            data = make_thumbnail(bytes(data), self.max_size)
+            tmp_path = f"{local_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, local_path)
+            logging.info(f"预览图片下载完成: {local_path}")
+            telemetry.record_preview("ok", time.monotonic() - started, len(data))
+            return True
+        except Exception as e:
+            logging.error(f"下载预览图片时出错: {e}")
+            self.record_failure(image_url)
+            telemetry.record_preview("error", time.monotonic() - started, len(data))
+            return False
@@ -0,0 +1,116 @@
+import threading
+import time
+from contextlib import contextmanager
+
+TERMINAL_STATES = ("done", "failed", "cancelled")
+
+
+# 单个下载任务（同一个模型的所有文件）的进度：每个文件的字节数、状态和最近的速度
+class JobProgress:
+    def __init__(self, job):
+        self.job = job
+        self.files = {}
+        self.listeners = []
+        self.watchers = 0
+        self.last_emit = 0
+
+    def update_file(self, name, downloaded=None, total=None, state=None):
+        now = time.monotonic()
+        file = self.files.setdefault(name, {"name": name, "downloaded": 0, "total": 0, "state": "queued",
+                                            "speed": 0, "sample": None})
+        if downloaded is not None:
+            # 每隔至少 1 秒取一次样本计算速度，并做指数平滑，避免进度抖动
+            sample = file['sample']
+            if sample is None or downloaded < sample[1]:
+                file['sample'] = (now, downloaded)
+            elif now - sample[0] >= 1.0:
+                speed = (downloaded - sample[1]) / (now - sample[0])
+                file['speed'] = speed if not file['speed'] else file['speed'] * 0.6 + speed * 0.4
+                file['sample'] = (now, downloaded)
+            file['downloaded'] = downloaded
+        if total:
+            file['total'] = total
+        changed = state is not None and state != file['state']
+        if state is not None:
+            file['state'] = state
+            if state in TERMINAL_STATES:
+                file['speed'] = 0
+        return changed
+
+    def snapshot(self):
+        files = [{key: value for key, value in file.items() if key != 'sample'} for file in self.files.values()]
+        downloaded = sum(file['downloaded'] for file in files)
+        total = sum(file['total'] for file in files)
+        speed = sum(file['speed'] for file in files)
+        states = {file['state'] for file in files}
+        if not files:
+            state = "queued"
+        elif states <= set(TERMINAL_STATES):
+            state = "cancelled" if "cancelled" in states else "failed" if "failed" in states else "done"
+        else:
+            state = "downloading" if "downloading" in states else "queued"
+        return {
+            "job": self.job,
+            "state": state,
+            "downloaded": downloaded,
+            "total": total,
+            "speed": speed,
+            "eta": (total - downloaded) / speed if speed and total > downloaded else None,
+            "files": files,
+        }
+
+
+# 进程内所有下载任务的进度，按任务（本地清单的键）汇总后通知关注该任务的调用者。
+# 同一模型的下载由预下载发起、节点执行时复用时，节点同样可以收到进度
+class ProgressRegistry:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def watch(self, job, listener=None):
+        with self.lock:
+            progress = self.jobs.get(job)
+            if progress is None:
+                progress = self.jobs[job] = JobProgress(job)
+            progress.watchers += 1
+            if listener:
+                progress.listeners.append(listener)
+            snapshot = progress.snapshot()
+        if listener:
+            listener(job, snapshot)
+        try:
+            yield progress
+        finally:
+            with self.lock:
+                if listener:
+                    progress.listeners.remove(listener)
+                progress.watchers -= 1
+                if not progress.watchers:
+                    self.jobs.pop(job, None)
+
+    def update(self, job, name, downloaded=None, total=None, state=None):
+        if job is None:
+            return
+        with self.lock:
+            progress = self.jobs.get(job)
+            if progress is None:
+                return
+            changed = progress.update_file(name, downloaded, total, state)
+            now = time.monotonic()
+            # 状态变化立即通知，字节数的变化按时间间隔合并
+            if not changed and now - progress.last_emit < self.interval:
+                return
+            progress.last_emit = now
+            listeners = list(progress.listeners)
+            snapshot = progress.snapshot()
+        for listener in listeners:
+            listener(job, snapshot)
+
+    def stats(self):
+        with self.lock:
+            return [progress.snapshot() for progress in self.jobs.values()]
+
+
+progress = ProgressRegistry()
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+from fnmatch import fnmatch
+
+
+def directory_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if not os.path.islink(path):
+                    total += os.path.getsize(path)
+            except OSError:
+                pass
+    return total
+
+
+# 模型目录的磁盘配额：新下载会超出总配额或某类模型的配额时，
+# 按最近使用时间从旧到新清理插件下载的模型及其预览图片。
+# 固定（pinned）的模型和手动放入的文件不会被清理
+class DiskQuota:
+    def __init__(self, manifest, model_dirs, max_size=0, type_limits=None, pinned=None, blob_store=None):
+        self.manifest = manifest
+        self.model_dirs = model_dirs
+        self.max_size = max_size
+        self.type_limits = dict(type_limits or {})
+        self.pinned = list(pinned or [])
+        self.blob_store = blob_store
+
+    @property
+    def enabled(self):
+        return bool(self.max_size or any(self.type_limits.values()))
+
+    def is_pinned(self, key, entry):
+        model_type, source, model_id = json.loads(key)[:3]
+        names = [f"{source}:{model_id}", f"{model_type}:{source}:{model_id}", entry.get('relative_path') or '']
+        names.extend(os.path.basename(path) for path in entry.get('local_paths') or [])
+        return any(fnmatch(name, pattern) for pattern in self.pinned for name in names)
+
+    def usage(self):
+        return {model_type: directory_size(directory) for model_type, directory in self.model_dirs.items()
+                if os.path.isdir(directory)}
+
+    def make_room(self, model_type, required, keep_paths=()):
+        if not self.enabled or required <= 0:
+            return
+        usage = self.usage()
+        checks = []
+        if self.type_limits.get(model_type):
+            checks.append(([model_type], self.type_limits[model_type]))
+        if self.max_size:
+            checks.append((list(self.model_dirs), self.max_size))
+        keep_paths = {os.path.abspath(path) for path in keep_paths}
+
+        for model_types, limit in checks:
+            excess = sum(usage.get(t, 0) for t in model_types) + required - limit
+            if excess <= 0:
+                continue
+            for key, entry in self.get_candidates(model_types, keep_paths):
+                freed = self.evict(key, entry)
+                evicted_type = self.get_model_type(key)
+                usage[evicted_type] = usage.get(evicted_type, 0) - freed
+                excess -= freed
+                if excess <= 0:
+                    break
+            if excess > 0:
+                logging.warning(f"可清理的模型不足，下载后将超出磁盘配额 {limit / 1024 ** 3:.2f} GB 约 {excess / 1024 ** 3:.2f} GB")
+
+    @staticmethod
+    def get_model_type(key):
+        return json.loads(key)[0]
+
+    def get_candidates(self, model_types, keep_paths):
+        candidates = []
+        for key, entry in self.manifest.entries():
+            if self.get_model_type(key) not in model_types or self.is_pinned(key, entry):
+                continue
+            paths = [os.path.abspath(path) for path in entry.get('local_paths') or []]
+            if not paths or keep_paths.intersection(paths):
+                continue
+            candidates.append((entry.get('last_used') or entry.get('updated_at') or 0, key, entry))
+        candidates.sort(key=lambda item: item[0])
+        return [(key, entry) for _, key, entry in candidates]
+
+    def evict(self, key, entry):
+        # 只删除由插件下载的文件，返回释放的字节数
+        freed = 0
+        hashes = []
+        for path in entry.get('local_paths') or []:
+            if not os.path.isfile(path) or not self.manifest.is_downloaded(path):
+                continue
+            record = self.manifest.get_hash(path)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"清理模型文件失败: {path}: {e}")
+                continue
+            freed += size
+            if record:
+                hashes.append(record['sha256'])
+            logging.info(f"超出磁盘配额，清理最久未使用的模型: {path}")
+        preview_path = entry.get('preview_path')
+        if freed and preview_path and os.path.isfile(preview_path):
+            try:
+                freed += os.path.getsize(preview_path)
+                os.remove(preview_path)
+            except OSError as e:
+                logging.warning(f"清理预览图片失败: {preview_path}: {e}")
+        if freed:
+            self.manifest.remove(key)
+        if self.blob_store:
+            for sha256 in hashes:
+                if not self.manifest.find_by_hash(sha256):
+                    self.blob_store.release(sha256)
+        return freed
@@ -0,0 +1,293 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from urllib.parse import urlparse
+
+# 优先级数值越小越优先：工作流执行时阻塞等待的下载 > 工作流排队时的预下载 > 后台批量下载
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_PREFETCH: "prefetch",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class DownloadCancelledError(Exception):
+    pass
+
+
+# 令牌桶限速：按字节数预约令牌，返回需要等待的秒数；rate 为 0 表示不限速
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+# 统计最近几秒内的传输速度
+class RateMeter:
+    def __init__(self, window=5.0):
+        self.window = window
+        self.samples = deque()
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.samples.append((time.monotonic(), size))
+            self.total += size
+            self._expire(time.monotonic())
+
+    def _expire(self, now):
+        while self.samples and now - self.samples[0][0] > self.window:
+            self.total -= self.samples.popleft()[1]
+
+    def rate(self):
+        with self.lock:
+            self._expire(time.monotonic())
+            return self.total / self.window
+
+
+class Transfer:
+    def __init__(self, scheduler, url, job, seq):
+        self.scheduler = scheduler
+        self.url = url
+        self.host = urlparse(url).netloc
+        self.job = job
+        self.seq = seq
+        self.preempted = 0
+        # 排队等待（包括被抢占后重新等待）的总秒数
+        self.waited = 0.0
+
+    @property
+    def priority(self):
+        return self.scheduler.job_priority(self.job)
+
+    def consume(self, size):
+        # 每读取一块数据调用一次：先按全局和主机限速等待，再检查是否需要让出给更高优先级的传输
+        self.scheduler.consume(self, size)
+
+
+# 进程内所有模型下载共用的传输调度器：限制并发传输数、全局和按主机限速，
+# 并按优先级排队，工作流正在等待的模型会抢占预下载和后台下载
+class TransferScheduler:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.active = []
+        self.waiting = []
+        self.jobs = {}
+        # 同一工作流预下载的任务属于同一组：任务 -> 所属的组，组 -> 其中的任务
+        self.job_groups = {}
+        self.groups = {}
+        self.cancelled = set()
+        self.local = threading.local()
+        self.seq = count()
+        self.meter = RateMeter()
+        self.host_meters = {}
+        self.configure()
+
+    def configure(self, max_transfers=0, rate_limit=0, host_rate_limit=0, host_rate_limits=None, preempt=True):
+        with self.condition:
+            self.max_transfers = max_transfers
+            self.rate_limit = rate_limit
+            self.host_rate_limit = host_rate_limit
+            self.host_rate_limits = dict(host_rate_limits or {})
+            self.preempt = preempt
+            self.bucket = TokenBucket(rate_limit)
+            self.host_buckets = {}
+            self.condition.notify_all()
+
+    def get_host_bucket(self, host):
+        with self.condition:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.host_rate_limits.get(host, self.host_rate_limit))
+                self.host_buckets[host] = bucket
+            return bucket
+
+    @contextmanager
+    def request(self, job, priority, group=None):
+        # 登记对某个下载任务的需求；多个调用者等待同一任务时按其中最高的优先级调度，
+        # 这样执行中的节点复用正在进行的预下载时，该下载会被提升为最高优先级
+        with self.condition:
+            self.jobs.setdefault(job, []).append(priority)
+            if group is not None:
+                self.job_groups.setdefault(job, []).append(group)
+                self.groups.setdefault(group, []).append(job)
+            self.condition.notify_all()
+        previous = getattr(self.local, 'job', None)
+        self.local.job = job
+        try:
+            yield
+        finally:
+            self.local.job = previous
+            with self.condition:
+                priorities = self.jobs[job]
+                priorities.remove(priority)
+                if not priorities:
+                    del self.jobs[job]
+                    self.cancelled.discard(job)
+                if group is not None:
+                    self._discard_group(job, group)
+                self.condition.notify_all()
+
+    def _discard_group(self, job, group):
+        groups = self.job_groups[job]
+        groups.remove(group)
+        if not groups:
+            del self.job_groups[job]
+        jobs = self.groups[group]
+        jobs.remove(job)
+        if not jobs:
+            del self.groups[group]
+
+    def cancel(self, job):
+        # 取消任务的所有传输：排队中的传输不再开始，进行中的传输在读取下一块数据时中止。
+        # 已下载的数据保留在 .part 文件中，之后可以继续下载
+        with self.condition:
+            if job not in self.jobs:
+                return False
+            self.cancelled.add(job)
+            self.condition.notify_all()
+        return True
+
+    def check_cancelled(self, transfer):
+        if transfer.job is not None and transfer.job in self.cancelled:
+            raise DownloadCancelledError(f"下载已取消: {transfer.url}")
+
+    def current_job(self):
+        # 线程池中的工作线程需要由提交任务的线程传入该值
+        return getattr(self.local, 'job', None)
+
+    @contextmanager
+    def job_context(self, job):
+        previous = getattr(self.local, 'job', None)
+        self.local.job = job
+        try:
+            yield
+        finally:
+            self.local.job = previous
+
+    def job_priority(self, job):
+        priorities = self.jobs.get(job)
+        if not priorities:
+            return PRIORITY_INTERACTIVE
+        # 工作流开始执行后（其中某个模型被执行中的节点请求），同一工作流其余的预下载也按最高优先级进行，
+        # 否则第一个下载节点会暂停同一工作流中其他模型的预下载，下载又变回逐个进行
+        for group in self.job_groups.get(job, ()):
+            if any(min(self.jobs[other]) == PRIORITY_INTERACTIVE for other in self.groups[group] if other in self.jobs):
+                return PRIORITY_INTERACTIVE
+        return min(priorities)
+
+    def _can_start(self, transfer):
+        priority = transfer.priority
+        key = (priority, transfer.seq)
+        if any((waiter.priority, waiter.seq) < key for waiter in self.waiting if waiter is not transfer):
+            return False
+        if self.max_transfers and len(self.active) >= self.max_transfers:
+            return False
+        if self.preempt and any(other.priority < priority for other in self.active):
+            return False
+        return True
+
+    def _should_yield(self, transfer):
+        if not self.preempt:
+            return False
+        priority = transfer.priority
+        if any(other.priority < priority for other in self.active if other is not transfer):
+            return True
+        return bool(self.max_transfers) and len(self.active) >= self.max_transfers and \
+            any(waiter.priority < priority for waiter in self.waiting)
+
+    def _wait_for_slot(self, transfer):
+        self.waiting.append(transfer)
+        started = time.monotonic()
+        try:
+            self.check_cancelled(transfer)
+            while not self._can_start(transfer):
+                # 优先级可能随任务需求变化，定期重新检查
+                self.condition.wait(timeout=1.0)
+                self.check_cancelled(transfer)
+        finally:
+            self.waiting.remove(transfer)
+            transfer.waited += time.monotonic() - started
+        self.active.append(transfer)
+
+    @contextmanager
+    def transfer(self, url, job=None):
+        with self.condition:
+            transfer = Transfer(self, url, job, next(self.seq))
+            self._wait_for_slot(transfer)
+        try:
+            yield transfer
+        finally:
+            with self.condition:
+                if transfer in self.active:
+                    self.active.remove(transfer)
+                self.condition.notify_all()
+
+    def consume(self, transfer, size):
+        self.meter.add(size)
+        with self.condition:
+            meter = self.host_meters.setdefault(transfer.host, RateMeter())
+            bucket = self.bucket
+        meter.add(size)
+        wait = max(bucket.reserve(size), self.get_host_bucket(transfer.host).reserve(size))
+        if wait > 0:
+            time.sleep(wait)
+
+        with self.condition:
+            self.check_cancelled(transfer)
+            if not self._should_yield(transfer):
+                return
+            transfer.preempted += 1
+            self.active.remove(transfer)
+            self.condition.notify_all()
+            logging.info(f"有更高优先级的下载，暂停传输: {transfer.url}")
+            self._wait_for_slot(transfer)
+            logging.info(f"恢复传输: {transfer.url}")
+
+    def stats(self):
+        with self.condition:
+            transfers = [(transfer, "active") for transfer in self.active] + \
+                        [(transfer, "queued") for transfer in self.waiting]
+            priorities = {name: {"active": 0, "queued": 0} for name in PRIORITY_NAMES.values()}
+            hosts = {}
+            for transfer, state in transfers:
+                priorities[PRIORITY_NAMES[transfer.priority]][state] += 1
+                host = hosts.setdefault(transfer.host, {"active": 0, "queued": 0})
+                host[state] += 1
+            for host, meter in self.host_meters.items():
+                hosts.setdefault(host, {"active": 0, "queued": 0})
+                hosts[host]["rate"] = meter.rate()
+                hosts[host]["rate_limit"] = self.host_rate_limits.get(host, self.host_rate_limit)
+            return {
+                "active": len(self.active),
+                "queued": len(self.waiting),
+                "max_transfers": self.max_transfers,
+                "rate": self.meter.rate(),
+                "rate_limit": self.rate_limit,
+                "preempt": self.preempt,
+                "priorities": priorities,
+                "hosts": hosts,
+            }
+
+
+scheduler = TransferScheduler()
@@ -0,0 +1,114 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from http.client import HTTPException
+
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+
+class StreamInterruptedError(IOError):
+    pass
+
+
+_buffers = threading.local()
+
+
+def get_buffer(size):
+    # 每个线程复用同一块缓冲区，避免每个数据块都分配新的 bytes 对象
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) != size:
+        buffer = bytearray(size)
+        _buffers.buffer = buffer
+    return buffer
+
+
+def check_free_space(directory, required, reserve=0):
+    # 下载前检查磁盘剩余空间，避免下载了几十 GB 之后才因为磁盘写满而失败
+    os.makedirs(directory, exist_ok=True)
+    free = shutil.disk_usage(directory).free
+    if required + reserve > free:
+        raise ValueError(
+            f"磁盘空间不足: {directory} 需要 {(required + reserve) / 1024 ** 3:.2f} GB，"
+            f"剩余 {free / 1024 ** 3:.2f} GB"
+        )
+
+
+def preallocate(file, offset, length):
+    # 预先分配磁盘空间，减少碎片并尽早暴露空间不足的问题；不支持的平台上只设置文件大小
+    if length <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(file.fileno(), offset, length)
+            return
+        except OSError as e:
+            logging.debug(f"posix_fallocate 不可用，改为设置文件大小: {e}")
+    file.truncate(offset + length)
+
+
+def get_direct_reader(raw):
+    # urllib3 的 readinto 内部先 read 出一个新的 bytes 对象再复制到缓冲区，每块数据多一次分配和拷贝。
+    # 响应没有压缩编码时，直接从底层的 http.client 响应读入缓冲区
+    fp = getattr(raw, '_fp', None)
+    encoding = raw.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity') and hasattr(fp, 'readinto') and hasattr(fp, 'isclosed'):
+        return fp
+    return None
+
+
+def copy_stream(response, file, buffer_size, on_chunk, should_stop=None):
+    # 用大块可复用缓冲区从响应读取数据并写入文件，返回写入的字节数
+    raw = response.raw
+    raw.decode_content = True
+    direct = get_direct_reader(raw)
+    readinto = direct.readinto if direct else raw.readinto
+    buffer = get_buffer(buffer_size)
+    view = memoryview(buffer)
+    written = 0
+    while True:
+        if should_stop and should_stop():
+            break
+        try:
+            size = readinto(view)
+        except (Urllib3HTTPError, HTTPException, OSError) as e:
+            # 只把读取响应时的错误当作网络中断；写入文件时的磁盘错误直接抛出
+            raise StreamInterruptedError(f"连接中断: {e}") from e
+        if not size:
+            break
+        chunk = view[:size]
+        file.write(chunk)
+        written += size
+        on_chunk(chunk)
+    if direct and direct.isclosed():
+        # 与 urllib3 自己读完响应时一样，把连接放回连接池以便复用
+        raw.release_conn()
+    return written
+
+
+# 按时间间隔合并进度更新，避免每个数据块都调用一次进度回调
+class ProgressThrottle:
+    def __init__(self, callback, interval=0.5):
+        self.callback = callback
+        self.interval = interval
+        self.last_report = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.pending += size
+            now = time.monotonic()
+            if now - self.last_report < self.interval:
+                return
+            self.last_report = now
+            pending, self.pending = self.pending, 0
+        self.callback(pending)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, 0
+            self.last_report = time.monotonic()
+        if pending:
+            self.callback(pending)
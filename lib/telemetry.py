@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .scheduler import DownloadCancelledError
+
+PHASES = ("metadata", "lock", "queue", "connect", "transfer", "hash", "preview")
+COUNTERS = ("bytes", "http_retries", "resume_retries", "mirror_failovers", "store_links")
+
+
+def get_retry_count(response):
+    # urllib3 的 Retry 对象记录了这次请求在连接池层面的重试历史
+    retries = getattr(getattr(response, 'raw', None), 'retries', None)
+    return len(getattr(retries, 'history', None) or ())
+
+
+# 单次模型下载的指标：各阶段耗时（多个文件或分段并行时累加）、字节数、重试次数和使用的镜像
+class DownloadMetrics:
+    def __init__(self, **fields):
+        self.fields = fields
+        self.started = time.monotonic()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.mirrors = set()
+        self.transfers = []
+        self.lock = threading.Lock()
+
+    def add_phase(self, name, seconds):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def mark_transfer(self, started, finished):
+        with self.lock:
+            self.transfers.append((started, finished))
+
+    def transfer_time(self):
+        # 各次传输时间区间的并集：并行的分段只计一次，重试前的等待不计入
+        total, end = 0.0, None
+        for started, finished in sorted(self.transfers):
+            if end is None or started > end:
+                total += finished - started
+                end = finished
+            elif finished > end:
+                total += finished - end
+                end = finished
+        return total
+
+    def to_event(self, outcome):
+        with self.lock:
+            span = self.transfer_time()
+            return dict(
+                self.fields,
+                event="download",
+                outcome=outcome,
+                time=time.time(),
+                duration=time.monotonic() - self.started,
+                phases={name: round(seconds, 4) for name, seconds in self.phases.items()},
+                throughput=self.counters['bytes'] / span if span > 0 else None,
+                mirrors=sorted(self.mirrors),
+                **self.counters,
+            )
+
+
+# 进程内的下载指标：按下载任务收集各阶段的耗时，汇总成计数器，
+# 同时保留最近的事件，并可以把每个事件追加写入 JSONL 文件
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.recent = deque(maxlen=100)
+        self.event_log = None
+        self.resolves = {}
+        self.downloads = {}
+        self.bytes = {}
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.phase_counts = dict.fromkeys(PHASES, 0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.previews = {}
+        self.collectors = []
+
+    def configure(self, event_log=None, recent_events=100):
+        with self.lock:
+            self.event_log = event_log
+            if self.recent.maxlen != recent_events:
+                self.recent = deque(self.recent, maxlen=recent_events)
+
+    @contextmanager
+    def track(self, job, **fields):
+        metrics = DownloadMetrics(job=job, **fields)
+        with self.lock:
+            self.jobs[job] = metrics
+        outcome = "error"
+        try:
+            yield metrics
+            outcome = "ok"
+        except BaseException as e:
+            outcome = "cancelled" if isinstance(e, DownloadCancelledError) else "error"
+            raise
+        finally:
+            with self.lock:
+                self.jobs.pop(job, None)
+            self.record_download(metrics.to_event(outcome))
+
+    @contextmanager
+    def collect(self, jobs):
+        # 收集指定任务在此期间结束的下载事件，用于统计一组模型自己传输的字节数，不受同时进行的其他下载影响。
+        # 加入正在进行的下载（如同一模型的预下载）时，事件中包含该下载开始以来的全部字节
+        collector = (set(jobs), [])
+        with self.lock:
+            self.collectors.append(collector)
+        try:
+            yield collector[1]
+        finally:
+            with self.lock:
+                self.collectors.remove(collector)
+
+    def get(self, job):
+        if job is None:
+            return None
+        with self.lock:
+            return self.jobs.get(job)
+
+    @contextmanager
+    def phase(self, job, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(job, name, time.monotonic() - started)
+
+    def add_phase(self, job, name, seconds):
+        metrics = self.get(job)
+        if metrics:
+            metrics.add_phase(name, seconds)
+
+    def add(self, job, name, value=1):
+        metrics = self.get(job)
+        if metrics:
+            metrics.add(name, value)
+
+    def annotate(self, job, **fields):
+        metrics = self.get(job)
+        if metrics:
+            with metrics.lock:
+                metrics.fields.update(fields)
+
+    def add_mirror(self, job, mirror):
+        metrics = self.get(job)
+        if metrics:
+            with metrics.lock:
+                metrics.mirrors.add(mirror)
+
+    def mark_transfer(self, job, started, finished):
+        metrics = self.get(job)
+        if metrics:
+            metrics.mark_transfer(started, finished)
+
+    def record_resolve(self, cache, **fields):
+        # 直接命中本地清单时记录；需要访问远端的解析在 track 结束时随下载事件一起记录
+        with self.lock:
+            self.resolves[cache] = self.resolves.get(cache, 0) + 1
+        self.write_event(dict(fields, event="resolve", cache=cache, time=time.time()))
+
+    def record_download(self, event):
+        with self.lock:
+            cache = event.get('cache') or "miss"
+            self.resolves[cache] = self.resolves.get(cache, 0) + 1
+            self.downloads[event['outcome']] = self.downloads.get(event['outcome'], 0) + 1
+            source = event.get('source') or "unknown"
+            self.bytes[source] = self.bytes.get(source, 0) + event['bytes']
+            for name, seconds in event['phases'].items():
+                if seconds:
+                    self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+                    self.phase_counts[name] = self.phase_counts.get(name, 0) + 1
+            for name in COUNTERS:
+                self.counters[name] += event.get(name, 0)
+            for jobs, events in self.collectors:
+                if event.get('job') in jobs:
+                    events.append(event)
+        self.write_event(event)
+
+    def record_preview(self, outcome, duration, size):
+        with self.lock:
+            self.previews[outcome] = self.previews.get(outcome, 0) + 1
+            self.phase_seconds['preview'] += duration
+            self.phase_counts['preview'] += 1
+        self.write_event({"event": "preview", "outcome": outcome, "duration": duration, "bytes": size, "time": time.time()})
+
+    def write_event(self, event):
+        with self.lock:
+            self.recent.append(event)
+            event_log = self.event_log
+            if not event_log:
+                return
+            try:
+                os.makedirs(os.path.dirname(event_log) or '.', exist_ok=True)
+                with open(event_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError as e:
+                logging.warning(f"写入下载事件日志失败: {event_log}: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "resolves": dict(self.resolves),
+                "downloads": dict(self.downloads),
+                "bytes": dict(self.bytes),
+                "phases": {name: {"seconds": self.phase_seconds[name], "count": self.phase_counts[name]}
+                           for name in self.phase_seconds},
+                "counters": dict(self.counters),
+                "previews": dict(self.previews),
+                "recent": list(self.recent),
+            }
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels.items()) + "}"
+
+
+def format_prometheus(snapshot, scheduler_stats=None, metadata_stats=None):
+    # 输出 Prometheus 文本格式（0.0.4）
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP model_downloader_{name} {help_text}")
+        lines.append(f"# TYPE model_downloader_{name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"model_downloader_{name}{format_labels(labels)} {value}")
+
+    metric("resolves_total", "counter", "Model path resolutions by manifest cache result.",
+           [({"cache": cache}, count) for cache, count in snapshot['resolves'].items()])
+    metric("downloads_total", "counter", "Model downloads by outcome.",
+           [({"outcome": outcome}, count) for outcome, count in snapshot['downloads'].items()])
+    metric("bytes_total", "counter", "Bytes transferred by source.",
+           [({"source": source}, size) for source, size in snapshot['bytes'].items()])
+    metric("phase_seconds_sum", "counter", "Total seconds spent per download phase.",
+           [({"phase": phase}, data['seconds']) for phase, data in snapshot['phases'].items()])
+    metric("phase_seconds_count", "counter", "Number of downloads that went through each phase.",
+           [({"phase": phase}, data['count']) for phase, data in snapshot['phases'].items()])
+    for name, value in snapshot['counters'].items():
+        if name != "bytes":
+            metric(f"{name}_total", "counter", f"Total {name.replace('_', ' ')}.", [({}, value)])
+    metric("previews_total", "counter", "Preview image fetches by outcome.",
+           [({"outcome": outcome}, count) for outcome, count in snapshot['previews'].items()])
+    if metadata_stats:
+        metric("metadata_requests_total", "counter", "Metadata cache lookups by result.",
+               [({"result": result}, count) for result, count in metadata_stats.items()])
+    if scheduler_stats:
+        metric("transfers_active", "gauge", "Transfers currently running.", [({}, scheduler_stats['active'])])
+        metric("transfers_queued", "gauge", "Transfers waiting for a slot.", [({}, scheduler_stats['queued'])])
+        metric("transfer_rate_bytes", "gauge", "Recent transfer rate in bytes per second.",
+               [({}, scheduler_stats['rate'])] +
+               [({"host": host}, data.get('rate', 0)) for host, data in scheduler_stats['hosts'].items()])
+    return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
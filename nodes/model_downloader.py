@@ -1,6 +1,8 @@
 import os
 import json
-from ..lib.model_downloader import ModelDownloader
+from ..lib.model_downloader import get_model_downloader
+from ..lib.batch import parse_model_set, download_model_set, format_summary
+from .progress import NodeProgress
 import logging
 
 # Hack: string type that is always equal in not equal comparisons
@@ -32,6 +34,9 @@ class BaseModelDownloader:
                     "multiline": True, 
                     "placeholder": "仅在huggingface下载时生效，支持多个文件，每行一个，空下载所有文件"
                 })
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
             }
         }
 
@@ -41,10 +46,18 @@ class BaseModelDownloader:
     OUTPUT_NODE = True
 
     @classmethod
-    def download_and_get_filename(cls, source, model_id, base_model, version_id=None, file_names=None, progress_callback=None):
-        downloader = ModelDownloader(progress_callback=progress_callback)
+    def get_download_args(cls, source, model_id, base_model, version_id=None, file_names=None):
         file_names_list = file_names.splitlines() if file_names and source == "huggingface" else None
-        main_model_path, model_details = downloader.ensure_downloaded(cls.MODEL_TYPE, model_id, source, base_model, version_id, file_names_list)
+        return cls.MODEL_TYPE, model_id, source, base_model, version_id, file_names_list
+
+    @classmethod
+    def download_and_get_filename(cls, source, model_id, base_model, version_id=None, file_names=None, progress_callback=None, unique_id=None):
+        downloader = get_model_downloader()
+        # 下载进度实时发送到前端节点，节点上可以取消下载
+        with NodeProgress(unique_id) as node_progress:
+            main_model_path, model_details = downloader.ensure_downloaded(
+                *cls.get_download_args(source, model_id, base_model, version_id, file_names),
+                progress_callback=progress_callback, progress_listener=node_progress)
 
         # 格式化模型详情为中文字符串
         formatted_details = f"模型名称: {model_details['name']}\n"
@@ -84,3 +97,37 @@ class DownloadUNET(BaseModelDownloader):
 class DownloadControlNet(BaseModelDownloader):
     MODEL_TYPE = "controlnet"
     RETURN_NAMES = ("controlnet_name",)
+
+class DownloadModelSet:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "models": ("STRING", {
+                    "default": "",
+                    "multiline": True,
+                    "placeholder": "JSON 或 YAML 格式的模型列表，每项包含 type、source、model_id、version_id、base_model、files"
+                }),
+                "max_workers": ("INT", {"default": 4, "min": 1, "max": 32})
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID"
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("paths", "summary")
+    FUNCTION = "download_model_set"
+    CATEGORY = "Model (Down)load"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def download_model_set(cls, models, max_workers=4, unique_id=None):
+        entries = parse_model_set(models)
+        with NodeProgress(unique_id) as node_progress:
+            paths, summary = download_model_set(get_model_downloader(), entries, max_workers,
+                                                progress_listener=node_progress)
+        formatted_summary = format_summary(summary)
+        logging.info(formatted_summary)
+        paths_json = json.dumps(paths, ensure_ascii=False, indent=2)
+        return {"ui": {"model_details": (formatted_summary,)}, "result": (paths_json, formatted_summary)}
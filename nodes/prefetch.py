@@ -0,0 +1,82 @@
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from ..lib.model_downloader import get_model_downloader
+from ..lib.batch import parse_model_set, get_download_args
+from ..lib.scheduler import PRIORITY_PREFETCH
+from .model_downloader import BaseModelDownloader
+
+try:
+    from server import PromptServer
+except ImportError:
+    PromptServer = None
+
+_executor = None
+
+
+def get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model_prefetch")
+    return _executor
+
+
+def get_download_node_classes():
+    return {cls.__name__: cls for cls in BaseModelDownloader.__subclasses__()}
+
+
+def find_download_requests(prompt):
+    # 找出工作流中所有输入均为常量（没有连接其他节点）的下载节点
+    node_classes = get_download_node_classes()
+    requests = []
+    for node_id, node in (prompt or {}).items():
+        inputs = node.get('inputs', {})
+        if any(isinstance(value, list) for value in inputs.values()):
+            continue
+        if node.get('class_type') == 'DownloadModelSet':
+            requests.extend(args for args in map(get_download_args, parse_model_set(inputs.get('models', '')))
+                            if args not in requests)
+            continue
+        node_class = node_classes.get(node.get('class_type'))
+        if node_class is None:
+            continue
+        if not inputs.get('source') or not inputs.get('model_id') or not inputs.get('base_model'):
+            continue
+        args = node_class.get_download_args(
+            inputs['source'], inputs['model_id'], inputs['base_model'],
+            inputs.get('version_id'), inputs.get('file_names'))
+        if args not in requests:
+            requests.append(args)
+    return requests
+
+
+def prefetch(downloader, args, group=None):
+    try:
+        # 预下载以较低优先级进行，工作流执行到需要其中某个模型时，同一工作流的所有预下载都会被提升为最高优先级
+        downloader.ensure_downloaded(*args, priority=PRIORITY_PREFETCH, group=group)
+    except Exception as e:
+        # 预下载失败不影响工作流，节点执行时会重新尝试并报告错误
+        logging.warning(f"预下载模型失败: {args[2]} {args[1]}: {e}")
+
+
+def on_prompt(json_data):
+    # 工作流排队时立即在后台并发下载其中的所有模型，节点执行时直接复用已完成或正在进行的下载
+    try:
+        requests = find_download_requests(json_data.get('prompt'))
+        if not requests:
+            return json_data
+        downloader = get_model_downloader()
+        if not downloader.config.getboolean('prefetch', 'enabled', fallback=True):
+            return json_data
+        executor = get_executor(downloader.config.getint('prefetch', 'max_workers', fallback=4))
+        logging.info(f"开始预下载工作流中的 {len(requests)} 个模型")
+        group = json_data.get('prompt_id') or uuid.uuid4().hex
+        for args in requests:
+            executor.submit(prefetch, downloader, args, group)
+    except Exception as e:
+        logging.warning(f"解析工作流中的下载节点失败，跳过预下载: {e}")
+    return json_data
+
+
+if PromptServer is not None and getattr(PromptServer, 'instance', None) is not None:
+    PromptServer.instance.add_on_prompt_handler(on_prompt)
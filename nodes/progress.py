@@ -0,0 +1,104 @@
+import logging
+import threading
+from ..lib.scheduler import scheduler, DownloadCancelledError
+
+try:
+    from server import PromptServer
+except ImportError:
+    PromptServer = None
+
+try:
+    import comfy.model_management as model_management
+except ImportError:
+    model_management = None
+
+EVENT = "model_downloader.progress"
+
+_reporters = {}
+_reporters_lock = threading.Lock()
+
+
+# 把节点关注的下载任务的进度通过 websocket 发送给前端，并支持从前端取消下载
+class NodeProgress:
+    def __init__(self, node_id):
+        self.node_id = str(node_id) if node_id is not None else None
+        self.jobs = {}
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        if self.node_id:
+            with _reporters_lock:
+                _reporters[self.node_id] = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.node_id:
+            with _reporters_lock:
+                if _reporters.get(self.node_id) is self:
+                    del _reporters[self.node_id]
+        if exc_type is None:
+            state = "done"
+        elif issubclass(exc_type, DownloadCancelledError):
+            state = "cancelled"
+        else:
+            state = "failed"
+        self.send(self.payload(state))
+        if state == "cancelled" and model_management is not None:
+            # 取消下载时中止整个工作流，而不是把它当作节点错误
+            raise model_management.InterruptProcessingException() from exc
+        return False
+
+    def __call__(self, job, snapshot):
+        with self.lock:
+            self.jobs[job] = snapshot
+            cancelled = self.cancelled
+        if cancelled:
+            # 批量下载时，取消之后才开始的任务同样取消
+            scheduler.cancel(job)
+        elif model_management is not None and getattr(model_management, 'processing_interrupted', lambda: False)():
+            # ComfyUI 界面上的“取消”同样会中止正在进行的下载
+            self.cancel()
+        self.send(self.payload())
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            jobs = list(self.jobs)
+        cancelled = [job for job in jobs if scheduler.cancel(job)]
+        logging.info(f"取消节点 {self.node_id} 的 {len(cancelled)} 个下载任务")
+        return True
+
+    def payload(self, state=None):
+        with self.lock:
+            snapshots = list(self.jobs.values())
+        files = [file for snapshot in snapshots for file in snapshot['files']]
+        downloaded = sum(snapshot['downloaded'] for snapshot in snapshots)
+        total = sum(snapshot['total'] for snapshot in snapshots)
+        speed = sum(snapshot['speed'] for snapshot in snapshots)
+        if state is None:
+            states = {snapshot['state'] for snapshot in snapshots}
+            state = "downloading" if "downloading" in states else "queued"
+        return {
+            "node": self.node_id,
+            "state": state,
+            "downloaded": downloaded,
+            "total": total,
+            "speed": speed,
+            "eta": (total - downloaded) / speed if speed and total > downloaded else None,
+            "files": files,
+        }
+
+    def send(self, payload):
+        if not self.node_id or PromptServer is None or getattr(PromptServer, 'instance', None) is None:
+            return
+        try:
+            PromptServer.instance.send_sync(EVENT, payload)
+        except Exception as e:
+            logging.debug(f"发送下载进度失败: {e}")
+
+
+def cancel_node(node_id):
+    with _reporters_lock:
+        reporter = _reporters.get(str(node_id))
+    return reporter.cancel() if reporter else False
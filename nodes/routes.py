@@ -0,0 +1,66 @@
+from aiohttp import web
+from ..lib.model_downloader import get_model_downloader
+from ..lib.scheduler import scheduler
+from ..lib.progress import progress
+from ..lib.telemetry import format_prometheus
+from .progress import cancel_node
+
+try:
+    from server import PromptServer
+except ImportError:
+    PromptServer = None
+
+
+async def get_scheduler_stats(request):
+    # 当前排队和进行中的传输数量，以及全局和各主机最近的传输速度（字节/秒）
+    return web.json_response(scheduler.stats())
+
+
+async def get_mirror_stats(request):
+    # 各镜像的健康状态、连续失败次数、延迟（秒）和最近的吞吐量（字节/秒）
+    return web.json_response(get_model_downloader().get_mirror_stats())
+
+
+async def get_progress(request):
+    # 所有正在进行的下载任务及其中每个文件的进度
+    return web.json_response(progress.stats())
+
+
+async def get_metrics(request):
+    # 累计的解析和下载次数、各阶段耗时、传输字节数、重试次数，以及最近的下载事件
+    return web.json_response(get_model_downloader().get_metrics())
+
+
+async def get_prometheus_metrics(request):
+    metrics = get_model_downloader().get_metrics()
+    text = format_prometheus(metrics, metrics['scheduler'], metrics['metadata_cache'])
+    return web.Response(text=text, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def get_audit_status(request):
+    # 最近一次完整校验的进度和结果：一致、没有下载记录和哈希不一致的文件
+    return web.json_response(get_model_downloader().audit.stats())
+
+
+async def start_audit(request):
+    # 在后台计算所有模型文件的 SHA256，已有校验在运行时不重复启动
+    downloader = get_model_downloader()
+    started = downloader.start_audit()
+    return web.json_response({"started": started, **downloader.audit.stats()})
+
+
+async def cancel_download(request):
+    data = await request.json()
+    cancelled = cancel_node(data.get('node_id'))
+    return web.json_response({"cancelled": cancelled})
+
+
+if PromptServer is not None and getattr(PromptServer, 'instance', None) is not None:
+    PromptServer.instance.routes.get("/model_downloader/scheduler")(get_scheduler_stats)
+    PromptServer.instance.routes.get("/model_downloader/mirrors")(get_mirror_stats)
+    PromptServer.instance.routes.get("/model_downloader/progress")(get_progress)
+    PromptServer.instance.routes.get("/model_downloader/metrics")(get_metrics)
+    PromptServer.instance.routes.get("/model_downloader/metrics/prometheus")(get_prometheus_metrics)
+    PromptServer.instance.routes.get("/model_downloader/audit")(get_audit_status)
+    PromptServer.instance.routes.post("/model_downloader/audit")(start_audit)
+    PromptServer.instance.routes.post("/model_downloader/cancel")(cancel_download)
@@ -1,14 +1,104 @@
 import { app } from "../../../scripts/app.js";
+import { api } from "../../../scripts/api.js";
 import { ComfyWidgets } from "../../../scripts/widgets.js";
 
+const DOWNLOAD_NODES = ["DownloadLora", "DownloadVAE", "DownloadUNET", "DownloadCheckpoint", "DownloadControlNet", "DownloadModelSet"];
+const FILE_STATES = { queued: "等待中", downloading: "下载中", done: "已完成", failed: "失败", cancelled: "已取消" };
+
+function formatSize(size) {
+	const units = ["B", "KB", "MB", "GB"];
+	let i = 0;
+	while (size >= 1024 && i < units.length - 1) {
+		size /= 1024;
+		i++;
+	}
+	return i ? `${size.toFixed(2)} ${units[i]}` : `${size} B`;
+}
+
+function formatEta(seconds) {
+	if (seconds == null) return "--";
+	seconds = Math.round(seconds);
+	if (seconds < 60) return `${seconds} 秒`;
+	if (seconds < 3600) return `${Math.floor(seconds / 60)} 分 ${seconds % 60} 秒`;
+	return `${Math.floor(seconds / 3600)} 小时 ${Math.floor((seconds % 3600) / 60)} 分`;
+}
+
+function formatProgress(detail) {
+	const percent = detail.total ? ` ${((detail.downloaded / detail.total) * 100).toFixed(1)}%` : "";
+	const lines = [
+		`${FILE_STATES[detail.state] ?? detail.state}${percent}  ${formatSize(detail.downloaded)}` +
+			(detail.total ? ` / ${formatSize(detail.total)}` : ""),
+		`速度: ${formatSize(detail.speed)}/s  剩余时间: ${formatEta(detail.eta)}`,
+	];
+	for (const file of detail.files ?? []) {
+		const filePercent = file.total ? ` ${((file.downloaded / file.total) * 100).toFixed(1)}%` : "";
+		lines.push(`${file.name}: ${FILE_STATES[file.state] ?? file.state}${filePercent}`);
+	}
+	return lines.join("\n");
+}
+
+function removeWidget(node, name) {
+	const pos = node.widgets?.findIndex((w) => w.name === name) ?? -1;
+	if (pos !== -1) {
+		node.widgets[pos].onRemove?.();
+		node.widgets.splice(pos, 1);
+	}
+}
+
 app.registerExtension({
     name: "ModelDownloader.DisplayModelDetail",
+    setup() {
+		// 下载进度由服务端按固定间隔推送，按节点 ID 找到对应的节点更新显示
+		api.addEventListener("model_downloader.progress", ({ detail }) => {
+			const node = app.graph.getNodeById(Number(detail.node)) ?? app.graph.getNodeById(detail.node);
+			node?.onDownloadProgress?.(detail);
+		});
+    },
     async beforeRegisterNodeDef(nodeType, nodeData, app) {
-        if (["DownloadLora", "DownloadVAE", "DownloadUNET", "DownloadCheckpoint"].includes(nodeData.name)) {
+        if (DOWNLOAD_NODES.includes(nodeData.name)) {
+			nodeType.prototype.onDownloadProgress = function (detail) {
+				const finished = ["done", "failed", "cancelled"].includes(detail.state);
+				if (finished && !detail.files?.length) {
+					removeWidget(this, "download_progress");
+					removeWidget(this, "cancel_download");
+					return;
+				}
+
+				let widget = this.widgets?.find((w) => w.name === "download_progress");
+				if (!widget) {
+					widget = ComfyWidgets["STRING"](this, "download_progress", ["STRING", { multiline: true }], app).widget;
+					widget.inputEl.readOnly = true;
+					widget.inputEl.style.opacity = 0.6;
+					widget.serialize = false;
+				}
+				widget.value = formatProgress(detail);
+
+				const cancelButton = this.widgets?.find((w) => w.name === "cancel_download");
+				if (finished) {
+					removeWidget(this, "cancel_download");
+				} else if (!cancelButton) {
+					const nodeId = this.id;
+					const button = this.addWidget("button", "cancel_download", null, () => {
+						button.label = "正在取消...";
+						api.fetchApi("/model_downloader/cancel", {
+							method: "POST",
+							headers: { "Content-Type": "application/json" },
+							body: JSON.stringify({ node_id: String(nodeId) }),
+						});
+					});
+					button.label = "取消下载";
+					button.serialize = false;
+				}
+				this.onResize?.(this.size);
+				this.setDirtyCanvas(true, true);
+			};
+
 			const onExecuted = nodeType.prototype.onExecuted;
 			nodeType.prototype.onExecuted = function (message) {
 				onExecuted?.apply(this, arguments);
 
+				removeWidget(this, "download_progress");
+				removeWidget(this, "cancel_download");
 				if (this.widgets) {
 					const pos = this.widgets.findIndex((w) => w.name === "result");
 					if (pos !== -1) {